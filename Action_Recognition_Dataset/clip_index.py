@@ -0,0 +1,163 @@
+# Virtual clip index for the action recognition dataset.
+#
+# Instead of writing the 3-second (1-second overlap) clips to disk, the segment
+# annotations are turned into a compact table of (video, start frame, end frame, label)
+# rows; clips are decoded lazily from the source videos when they are read. Changing
+# the clip length or overlap only rebuilds the table, which takes seconds.
+#
+# Segment annotations are read from a CSV with the columns
+#   video, label, start, end
+# where 'video' is the path relative to video_base and start/end are in seconds.
+import os
+import csv
+import threading
+import cv2
+import numpy as np
+from collections import OrderedDict
+
+CLIP_DTYPE = np.dtype([("video", np.int32), ("start", np.int64), ("end", np.int64), ("label", np.int16)])
+
+def video_fps(video_path, default_fps=30.0):
+    """Frame rate of a video (default_fps if the container does not report one)."""
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0
+    cap.release()
+    return fps if fps and fps > 0 else default_fps
+
+def build_clip_index(segments_csv, video_base, clip_seconds=3.0, overlap_seconds=1.0, default_fps=30.0):
+    """
+    Cut every annotated segment into fixed-length clips.
+
+    Clips start every (clip_seconds - overlap_seconds) inside a segment; segments
+    shorter than one clip are dropped. Returns (clips, videos, labels) where clips
+    is a CLIP_DTYPE array with end frames exclusive, and videos/labels are the lists
+    its 'video' and 'label' columns index into.
+    """
+    stride_seconds = clip_seconds - overlap_seconds
+    if stride_seconds <= 0:
+        raise ValueError("overlap_seconds must be smaller than clip_seconds")
+
+    with open(segments_csv, newline="") as f:
+        segments = list(csv.DictReader(f))
+    videos = sorted({row["video"] for row in segments})
+    labels = sorted({row["label"] for row in segments})
+    video_id = {v: k for k, v in enumerate(videos)}
+    label_id = {l: k for k, l in enumerate(labels)}
+    fps = {v: video_fps(os.path.join(video_base, v), default_fps) for v in videos}
+
+    chunks = []
+    for row in segments:
+        rate = fps[row["video"]]
+        seg_start = int(round(float(row["start"]) * rate))
+        seg_end = int(round(float(row["end"]) * rate))
+        clip_len = int(round(clip_seconds * rate))
+        stride = max(int(round(stride_seconds * rate)), 1)
+        starts = np.arange(seg_start, seg_end - clip_len + 1, stride, dtype=np.int64)
+        if not len(starts):
+            continue
+        chunk = np.empty(len(starts), dtype=CLIP_DTYPE)
+        chunk["video"] = video_id[row["video"]]
+        chunk["start"] = starts
+        chunk["end"] = starts + clip_len
+        chunk["label"] = label_id[row["label"]]
+        chunks.append(chunk)
+
+    clips = np.concatenate(chunks) if chunks else np.empty(0, dtype=CLIP_DTYPE)
+    # Sort by video and start so sequential readers mostly decode forward.
+    clips = clips[np.lexsort((clips["start"], clips["video"]))]
+    return clips, videos, labels
+
+def save_clip_index(path, clips, videos, labels):
+    np.savez(path, clips=clips, videos=np.array(videos), labels=np.array(labels))
+
+def load_clip_index(path):
+    with np.load(path) as npz:
+        return npz["clips"], [str(v) for v in npz["videos"]], [str(l) for l in npz["labels"]]
+
+class ClipReader:
+    """
+    Decode clips of a clip index on demand.
+
+    Each worker (process, and thread within it) keeps a small LRU cache of open
+    decoders, so consecutive clips of the same video reuse the open handle and only
+    seek when a clip starts before the decoder's current position.
+    """
+
+    def __init__(self, clips, videos, video_base, num_frames=None, resize=None, max_open=4):
+        self.clips = clips
+        self.videos = videos
+        self.video_base = video_base
+        self.num_frames = num_frames  # Frames sampled uniformly per clip (None = all).
+        self.resize = resize          # (width, height) or None.
+        self.max_open = max_open
+        self.local = threading.local()
+
+    def __len__(self):
+        return len(self.clips)
+
+    def _decoder(self, video):
+        cache = getattr(self.local, "decoders", None)
+        if cache is None or getattr(self.local, "pid", None) != os.getpid():
+            # Fresh cache per worker; handles must not be shared across forked processes.
+            cache = self.local.decoders = OrderedDict()
+            self.local.pid = os.getpid()
+        if video in cache:
+            cache.move_to_end(video)
+            return cache[video]
+        cap = cv2.VideoCapture(os.path.join(self.video_base, self.videos[video]))
+        if not cap.isOpened():
+            raise FileNotFoundError(f"Could not open video {self.videos[video]}")
+        handle = {"cap": cap, "pos": 0}
+        cache[video] = handle
+        while len(cache) > self.max_open:
+            cache.popitem(last=False)[1]["cap"].release()
+        return handle
+
+    def read(self, k):
+        """Return (frames, label) of clip k; frames is a (T, H, W, 3) uint8 BGR array."""
+        clip = self.clips[k]
+        handle = self._decoder(int(clip["video"]))
+        cap, start, end = handle["cap"], int(clip["start"]), int(clip["end"])
+        if self.num_frames:
+            wanted = np.linspace(start, end - 1, self.num_frames).round().astype(np.int64)
+        else:
+            wanted = np.arange(start, end)
+
+        # Seek only when the clip lies behind the decoder; short gaps are skipped with grab().
+        if start < handle["pos"] or start - handle["pos"] > 64:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            handle["pos"] = start
+        while handle["pos"] < start:
+            cap.grab()
+            handle["pos"] += 1
+
+        frames = []
+        for frame_idx in range(start, int(wanted[-1]) + 1):
+            ok = cap.grab()
+            handle["pos"] += 1
+            if not ok:
+                break
+            # Decode (retrieve) only the sampled frames.
+            repeats = int(np.count_nonzero(wanted == frame_idx))
+            if repeats:
+                _, frame = cap.retrieve()
+                if self.resize:
+                    frame = cv2.resize(frame, self.resize, interpolation=cv2.INTER_AREA)
+                frames.extend([frame] * repeats)
+        if len(frames) < len(wanted):
+            raise IOError(f"Clip {k} of {self.videos[int(clip['video'])]} ends past the end of the video")
+        return np.stack(frames), int(clip["label"])
+
+if __name__ == "__main__":
+    # --- Build the clip index ---
+    segments_csv = "action_segments.csv"                                  # Adjust the path as needed.
+    video_base = "/home/itec/sahar/Domain_Adaptation/Action_Recognition/videos"  # Adjust the path as needed.
+    clip_seconds = 3.0
+    overlap_seconds = 1.0
+    index_file = f"action_clips_{clip_seconds:g}s_{overlap_seconds:g}s.npz"
+
+    clips, videos, labels = build_clip_index(segments_csv, video_base, clip_seconds, overlap_seconds)
+    save_clip_index(index_file, clips, videos, labels)
+    print(f"Saved clip index: {index_file} ({len(clips)} clips from {len(videos)} videos)")
+    for k, label in enumerate(labels):
+        print(f"  {label}: {int(np.count_nonzero(clips['label'] == k))} clips")
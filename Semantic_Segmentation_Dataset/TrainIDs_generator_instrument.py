@@ -2,6 +2,10 @@ import os
 import random
 import csv
 import numpy as np
+from annotation_query import read_subset_paths
+from fold_statistics import fold_norm_stats
+from frame_hash_index import check_fold_leakage, hash_frames
+from video_signatures import assign_folds, load_signatures, similarity_matrix
 
 # Set the base dataset folder.
 dataset_base = "Lap_instrument_dataset"
@@ -10,6 +14,11 @@ dataset_base = "Lap_instrument_dataset"
 images_base = os.path.join(dataset_base, "instrument")
 masks_base = os.path.join(dataset_base, "instrument_mask")
 
+# Optional frame subset: a CSV written by annotation_query.write_subset(); only frames
+# whose path relative to images_base is listed there end up in the fold CSVs.
+image_subset_file = None
+subset_paths = read_subset_paths(image_subset_file) if image_subset_file else None
+
 # --- Step 1. Collect all patient directories ---
 # Patient directories are assumed to be subdirectories within each GANSEG_* folder.
 patient_dirs = []
@@ -31,6 +40,21 @@ random.shuffle(patient_dirs)
 # Use numpy's array_split to deal with uneven splits.
 folds = np.array_split(patient_dirs, 4)
 
+# Optional appearance-aware split from the per-video signatures of video_signatures.py
+# (no frames are read here): "same_fold" keeps videos that look alike in one fold, so
+# test videos differ in appearance from the training videos; "across_folds" spreads
+# similar videos over the folds. None keeps the random split above.
+similar_videos = None
+video_signature_file = "Lap_video_signatures.npz"
+
+if similar_videos:
+    signature_names, signatures = load_signatures(video_signature_file)
+    rel_patients = {os.path.relpath(p, images_base): p for p in patient_dirs}
+    fold_videos = assign_folds(list(rel_patients), signature_names, similarity_matrix(signatures),
+                               num_folds=4, mode=similar_videos)
+    folds = [np.array([rel_patients[v] for v in videos]) for videos in fold_videos]
+    print(f"Folds assigned by video appearance ({similar_videos}) from {video_signature_file}")
+
 # --- Helper function to get CSV rows from a set of patient directories ---
 def collect_rows(patient_list, images_base, masks_base, valid_ext=(".jpg", ".jpeg", ".png", ".bmp")):
     """
@@ -53,6 +77,8 @@ def collect_rows(patient_list, images_base, masks_base, valid_ext=(".jpg", ".jpe
                 file = file.decode("utf-8")
             if file.lower().endswith(valid_ext):
                 image_path = os.path.join(patient_dir, file)
+                if subset_paths is not None and os.path.join(rel_path, file) not in subset_paths:
+                    continue
                 mask_path = os.path.join(mask_patient_dir, file)
                 base, ext = os.path.splitext(file)
                 mask_file = f"{base}_mask{ext}"
@@ -64,6 +90,19 @@ def collect_rows(patient_list, images_base, masks_base, valid_ext=(".jpg", ".jpe
                 index += 1
     return rows
 
+# --- Near-duplicate leakage check settings ---
+# Frames whose perceptual hashes differ in at most 'leakage_max_distance' of 64 bits are
+# treated as near-duplicates; any such pair split across train and test is reported.
+# Off by default: hashing decodes every frame once (cached afterwards).
+check_leakage = False
+leakage_max_distance = 6
+hash_cache_file = "Lap_instrument_frame_hashes.npz"
+
+if check_leakage:
+    # Hash every frame once; each fold then only compares cached uint64 hashes.
+    all_image_paths = [row[1] for row in collect_rows(patient_dirs, images_base, masks_base)]
+    frame_hashes = hash_frames(all_image_paths, cache_file=hash_cache_file)
+
 # --- Step 3. Create CSV files for each fold ---
 # For each fold, use the patients in that fold as the test set and the rest as the train set.
 for i in range(4):
@@ -81,6 +120,11 @@ for i in range(4):
     # Define CSV filenames. These files will be saved in the current working directory.
     train_csv = f"Lap_instrument_train_{i}.csv"
     test_csv  = f"Lap_instrument_test_{i}.csv"
+
+    # Flag near-duplicate frames shared between this fold's test and train sets.
+    if check_leakage:
+        check_fold_leakage([row[1] for row in test_rows], [row[1] for row in train_rows], frame_hashes,
+                           f"Lap_instrument_leakage_{i}.csv", leakage_max_distance)
     
     # Write train CSV.
     with open(train_csv, "w", newline="") as f:
@@ -112,4 +156,53 @@ for i in range(4):
     for patient in sorted(train_patients):
         rel_path = os.path.relpath(patient, images_base)
         print(f"  {rel_path}")
-    print("\n")
\ No newline at end of file
+    print("\n")
+
+# --- Step 4. Save the class-presence index next to the fold CSVs ---
+# json_to_mask_* write a uint16 class-presence bitmask per frame into the mask folder.
+# Merge it with each frame's test fold so samplers (see class_presence_index.py) can
+# select "frames containing class X in fold i" without reading any mask.
+presence_file = os.path.join(masks_base, "class_presence.npz")
+if os.path.exists(presence_file):
+    with np.load(presence_file) as npz:
+        presence_of = dict(zip(npz["keys"], npz["presence"]))
+        class_names = npz["class_names"]
+
+    image_paths, fold_ids, presence, missing = [], [], [], 0
+    for i in range(4):
+        for _, image_path, _ in collect_rows(list(folds[i]), images_base, masks_base):
+            key = os.path.splitext(os.path.relpath(image_path, images_base))[0]
+            if key not in presence_of:
+                missing += 1
+            image_paths.append(image_path)
+            fold_ids.append(i)
+            presence.append(presence_of.get(key, 0))
+
+    fold_index_file = "Lap_instrument_class_presence.npz"
+    np.savez(fold_index_file,
+             image_paths=np.array(image_paths),
+             fold=np.array(fold_ids, dtype=np.int8),
+             presence=np.array(presence, dtype=np.uint16),
+             class_names=class_names)
+    print(f"Class-presence index saved: {fold_index_file} ({len(image_paths)} frames)")
+    if missing:
+        print(f"Warning: {missing} frames have no entry in {presence_file} (treated as background only).")
+else:
+    print(f"Warning: {presence_file} not found; run json_to_mask_* first to build the class-presence index.")
+
+# --- Step 5. Per-fold image normalization statistics ---
+# Per-channel histograms are accumulated per patient (cached, so frames are decoded
+# once in total) and merged into train/test mean/std for every fold.
+compute_norm_stats = False  # Off by default: the first run decodes every frame once.
+stats_cache_dir = "Lap_instrument_stats_cache"
+stats_json = "Lap_instrument_norm_stats.json"
+stats_hist_file = "Lap_instrument_norm_hist.npz"
+
+if compute_norm_stats:
+    patient_images = {patient: [row[1] for row in collect_rows([patient], images_base, masks_base)]
+                      for patient in patient_dirs}
+    stats = fold_norm_stats(folds, patient_images, images_base, stats_cache_dir, stats_json, stats_hist_file)
+    print(f"Normalization statistics saved: {stats_json}, histograms: {stats_hist_file}")
+    for i in range(4):
+        train_stats = stats[f"fold_{i}"]["train"]
+        print(f"  Fold {i} train mean {np.round(train_stats['mean'], 4)} std {np.round(train_stats['std'], 4)}")
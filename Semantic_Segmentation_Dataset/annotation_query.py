@@ -0,0 +1,147 @@
+# Indexed query layer over the COCO annotation files.
+#
+# The JSON is parsed once into per-annotation numpy arrays (image, effective class,
+# polygon area) plus indexes by class, image and video directory and an
+# image x class instance-count matrix. Queries return sets of image_ids and combine
+# with ordinary set operations. Subsets are saved with write_subset() and picked up
+# by json_to_mask_*, json_to_overlay_* and TrainIDs_generator_* via image_subset_file.
+#
+#   index = AnnotationIndex.from_json(json_file, {**Instrument_mapping, **AuxTool_mapping}, input_base)
+#   ids = index.select(min_counts={"grasper": 2})
+#   ids = index.select(classes=["sealer-divider", "thread"])
+#   ids = index.select(videos=["GANSEG_01/0.mp4_"], min_area=500)
+#   write_subset("subset.csv", index, ids)
+import os
+import csv
+import json
+import numpy as np
+
+def polygon_area(seg):
+    """Area of one flat [x0, y0, x1, y1, ...] polygon (shoelace formula)."""
+    pts = np.asarray(seg, dtype=np.float64).reshape(-1, 2)
+    if len(pts) < 3:
+        return 0.0
+    x, y = pts[:, 0], pts[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+class AnnotationIndex:
+    """In-memory indexes over one COCO annotation file, restricted to a class mapping."""
+
+    def __init__(self, data, mapping, input_base=""):
+        self.class_names = list(dict.fromkeys(mapping.values()))
+        class_index = {name: k for k, name in enumerate(self.class_names)}
+
+        # Relative path and video directory of every image.
+        self.rel_paths = {}
+        self.video_of = {}
+        for img in data.get("images", []):
+            img_path = img["path"]
+            if input_base and img_path.startswith(input_base + os.sep):
+                rel_path = img_path[len(input_base + os.sep):]
+            else:
+                rel_path = img_path
+            self.rel_paths[img["id"]] = rel_path
+            self.video_of[img["id"]] = os.path.dirname(rel_path)
+
+        # Per-annotation columns.
+        ann_image, ann_class, ann_area = [], [], []
+        for ann in data.get("annotations", []):
+            name = mapping.get(ann.get("category_id"))
+            if name is None or ann["image_id"] not in self.rel_paths:
+                continue
+            ann_image.append(ann["image_id"])
+            ann_class.append(class_index[name])
+            ann_area.append(sum(polygon_area(seg) for seg in ann.get("segmentation", [])))
+        self.ann_image = np.array(ann_image, dtype=np.int64)
+        self.ann_class = np.array(ann_class, dtype=np.int64)
+        self.ann_area = np.array(ann_area, dtype=np.float64)
+
+        # Image rows of the instance-count matrix (only annotated images).
+        self.image_ids, image_row = np.unique(self.ann_image, return_inverse=True)
+        n_classes = len(self.class_names)
+        self.counts = np.bincount(image_row * n_classes + self.ann_class,
+                                  minlength=len(self.image_ids) * n_classes
+                                  ).reshape(len(self.image_ids), n_classes)
+
+        self.by_class = {name: set(self.image_ids[self.counts[:, k] > 0].tolist())
+                         for k, name in enumerate(self.class_names)}
+        self.by_video = {}
+        for image_id in self.image_ids.tolist():
+            self.by_video.setdefault(self.video_of[image_id], set()).add(image_id)
+
+    @classmethod
+    def from_json(cls, json_file, mapping, input_base=""):
+        with open(json_file, "r") as f:
+            return cls(json.load(f), mapping, input_base)
+
+    def _class_column(self, class_name):
+        if class_name not in self.class_names:
+            raise KeyError(f"Unknown class {class_name!r}; expected one of {self.class_names}")
+        return self.class_names.index(class_name)
+
+    def all_images(self):
+        return set(self.image_ids.tolist())
+
+    def with_all(self, *class_names):
+        """Images containing every one of the classes (co-occurrence)."""
+        cols = [self._class_column(name) for name in class_names]
+        return set(self.image_ids[(self.counts[:, cols] > 0).all(axis=1)].tolist())
+
+    def with_any(self, *class_names):
+        """Images containing at least one of the classes."""
+        cols = [self._class_column(name) for name in class_names]
+        return set(self.image_ids[(self.counts[:, cols] > 0).any(axis=1)].tolist())
+
+    def with_count(self, class_name, min_count=1, max_count=None):
+        """Images with between min_count and max_count instances of a class."""
+        col = self.counts[:, self._class_column(class_name)]
+        keep = col >= min_count
+        if max_count is not None:
+            keep &= col <= max_count
+        return set(self.image_ids[keep].tolist())
+
+    def in_videos(self, *video_dirs):
+        """Images from the given video directories (relative, e.g. 'GANSEG_01/0.mp4_')."""
+        return set().union(*(self.by_video.get(v.rstrip("/"), set()) for v in video_dirs))
+
+    def with_area(self, min_area=0.0, max_area=np.inf, class_name=None):
+        """Images with at least one instance whose polygon area lies in [min_area, max_area]."""
+        keep = (self.ann_area >= min_area) & (self.ann_area <= max_area)
+        if class_name is not None:
+            keep &= self.ann_class == self._class_column(class_name)
+        return set(np.unique(self.ann_image[keep]).tolist())
+
+    def select(self, classes=None, any_classes=None, min_counts=None, videos=None,
+               min_area=None, max_area=None, area_class=None):
+        """Intersect the given filters; unspecified filters do not restrict the result."""
+        result = self.all_images()
+        if classes:
+            result &= self.with_all(*classes)
+        if any_classes:
+            result &= self.with_any(*any_classes)
+        for class_name, n in (min_counts or {}).items():
+            result &= self.with_count(class_name, n)
+        if videos:
+            result &= self.in_videos(*videos)
+        if min_area is not None or max_area is not None:
+            result &= self.with_area(min_area or 0.0, np.inf if max_area is None else max_area, area_class)
+        return result
+
+def write_subset(path, index, image_ids):
+    """Save a frame subset as CSV (image_id, relative path) for the generator scripts."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_id", "rel_path"])
+        for image_id in sorted(image_ids):
+            writer.writerow([image_id, index.rel_paths[image_id]])
+    print(f"Saved subset of {len(image_ids)} frames: {path}")
+
+def read_subset_ids(path):
+    """image_ids of a subset CSV (used by json_to_mask_* / json_to_overlay_*)."""
+    with open(path, newline="") as f:
+        return {int(row["image_id"]) for row in csv.DictReader(f)}
+
+def read_subset_paths(path):
+    """Relative frame paths of a subset CSV (used by TrainIDs_generator_*)."""
+    with open(path, newline="") as f:
+        return {os.path.normpath(row["rel_path"]) for row in csv.DictReader(f)}
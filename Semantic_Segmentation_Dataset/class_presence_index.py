@@ -0,0 +1,69 @@
+# Per-frame class-presence index for class-balanced sampling.
+#
+# json_to_mask_* store one uint16 bitmask per frame (bit k = k-th class of their
+# mask_label_mapping is annotated) in <mask dir>/class_presence.npz. The
+# TrainIDs_generator_* scripts merge it with the fold assignment into
+# Lap_<task>_class_presence.npz, which this module queries without touching any mask:
+#
+#   index = load_presence_index("Lap_instrument_class_presence.npz")
+#   rows = frames_with_class(index, "suturing-instrument", fold=2, split="train")
+#   paths = index["image_paths"][rows]
+import numpy as np
+
+def load_presence_index(index_file):
+    """Load a fold-level class-presence index into a dict of numpy arrays."""
+    with np.load(index_file) as npz:
+        return {key: npz[key] for key in npz.files}
+
+def class_matrix(presence, n_classes):
+    """Expand uint16 presence bitmasks into an (n_frames, n_classes) boolean matrix."""
+    bits = np.arange(n_classes, dtype=np.uint16)
+    return ((presence[:, None] >> bits) & 1).astype(bool)
+
+def split_mask(index, fold=None, split="train"):
+    """Boolean row mask of the frames in the train or test split of a fold (all frames if fold is None)."""
+    if fold is None:
+        return np.ones(len(index["presence"]), dtype=bool)
+    if split == "test":
+        return index["fold"] == fold
+    if split == "train":
+        return index["fold"] != fold
+    raise ValueError(f"split must be 'train' or 'test', got {split!r}")
+
+def frames_with_class(index, class_name, fold=None, split="train"):
+    """Return the row indices of frames containing class_name in the given fold split."""
+    class_names = list(index["class_names"])
+    if class_name not in class_names:
+        raise KeyError(f"Unknown class {class_name!r}; expected one of {class_names}")
+    bit = np.uint16(1 << class_names.index(class_name))
+    has_class = (index["presence"] & bit) != 0
+    return np.flatnonzero(has_class & split_mask(index, fold, split))
+
+def class_frame_lists(index, fold=None, split="train"):
+    """Return {class_name: row indices of the frames containing it} for the given fold split."""
+    rows = np.flatnonzero(split_mask(index, fold, split))
+    matrix = class_matrix(index["presence"][rows], len(index["class_names"]))
+    return {str(name): rows[matrix[:, k]] for k, name in enumerate(index["class_names"])}
+
+def sampling_weights(index, fold=None, split="train"):
+    """
+    Per-frame weights for class-balanced weighted sampling within a fold split.
+
+    A frame's weight is the largest inverse frame count among the classes it
+    contains, so frames with a rare class are drawn far more often. This is only
+    approximately class-balanced: a frame holding several classes counts toward
+    all of them at the weight of its rarest one, so rare classes get somewhat more
+    than 1/C of the total mass and common ones less. Frames without any class
+    keep the smallest weight.
+    Returns (row indices, weights normalised to sum to 1).
+    """
+    rows = np.flatnonzero(split_mask(index, fold, split))
+    matrix = class_matrix(index["presence"][rows], len(index["class_names"]))
+    counts = matrix.sum(axis=0)
+    inverse = np.where(counts > 0, 1.0 / np.maximum(counts, 1), 0.0)
+    weights = (matrix * inverse).max(axis=1, initial=0.0)
+    if weights.any():
+        weights[weights == 0] = weights[weights > 0].min()
+    else:
+        weights[:] = 1.0
+    return rows, weights / weights.sum()
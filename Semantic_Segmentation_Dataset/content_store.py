@@ -0,0 +1,96 @@
+# Content-addressed store for exported source frames.
+#
+# Every exported original is stored once under <store>/<aa>/<sha256><ext>, keyed by
+# the hash of its bytes; the per-task original trees written by json_to_overlay_*
+# (instrument_originals/, auxtool_originals/, anatomy_originals/) are built from hard
+# links into the store (symlinks across filesystems). A frame referenced by several
+# trees is therefore stored once, and re-exports skip frames the store already holds. Source
+# digests are cached in <store>/stat_index.tsv keyed by (path, size, mtime), so re-runs
+# only hash files that are new or have changed.
+import os
+import shutil
+import threading
+import hashlib
+
+def file_digest(path):
+    """SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+STAT_INDEX_NAME = "stat_index.tsv"
+_stat_indexes = {}  # store_dir -> {(abs path, size, mtime_ns): digest}
+_stat_lock = threading.Lock()
+
+def _load_stat_index(store_dir):
+    index = {}
+    path = os.path.join(store_dir, STAT_INDEX_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                # Skip lines cut short by a crash.
+                if len(fields) == 4 and len(fields[3]) == 64:
+                    index[(fields[0], int(fields[1]), int(fields[2]))] = fields[3]
+    return index
+
+def cached_digest(path, store_dir):
+    """file_digest(path), reused from the store's stat index while size and mtime are unchanged."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _stat_lock:
+        if store_dir not in _stat_indexes:
+            _stat_indexes[store_dir] = _load_stat_index(store_dir)
+        digest = _stat_indexes[store_dir].get(key)
+    if digest is None:
+        digest = file_digest(path)
+        with _stat_lock:
+            _stat_indexes[store_dir][key] = digest
+            os.makedirs(store_dir, exist_ok=True)
+            with open(os.path.join(store_dir, STAT_INDEX_NAME), "a") as f:
+                f.write("\t".join([key[0], str(key[1]), str(key[2]), digest]) + "\n")
+    return digest
+
+def store_file(src_path, store_dir):
+    """Add a file to the store (if not already there) and return its stored path."""
+    digest = cached_digest(src_path, store_dir)
+    ext = os.path.splitext(src_path)[1].lower()
+    stored_path = os.path.join(store_dir, digest[:2], digest + ext)
+    if not os.path.exists(stored_path):
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        # Copy under a temporary name first so a partial copy never looks stored.
+        tmp_path = f"{stored_path}.tmp{os.getpid()}_{threading.get_ident()}"
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, stored_path)
+    return stored_path
+
+def _link(stored_path, dest_path):
+    """Hard link stored_path to dest_path, falling back to a symlink across filesystems."""
+    try:
+        os.link(stored_path, dest_path)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        os.symlink(os.path.abspath(stored_path), dest_path)
+
+def link_into_tree(stored_path, dest_path):
+    """Make dest_path refer to stored_path (hard link, else symlink); returns False if it already does."""
+    if os.path.exists(dest_path):
+        if os.path.samefile(stored_path, dest_path):
+            return False
+        os.remove(dest_path)
+    elif os.path.islink(dest_path):
+        os.remove(dest_path)  # Dangling symlink from an earlier store location.
+    try:
+        _link(stored_path, dest_path)
+    except FileNotFoundError:
+        # Only create the directory when it is missing (callers usually create the tree up front).
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        _link(stored_path, dest_path)
+    return True
+
+def export_original(src_path, dest_path, store_dir):
+    """Export a source frame into a task tree through the store; returns False if it was already there."""
+    return link_into_tree(store_file(src_path, store_dir), dest_path)
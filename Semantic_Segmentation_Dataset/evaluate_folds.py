@@ -0,0 +1,162 @@
+# This script scores predicted masks against the ground-truth masks of each fold's
+# test set (Lap_<task>_test_{i}.csv from TrainIDs_generator_*).
+#
+# Gray levels are mapped to class indices with the task's mask_label_mapping through a
+# 256-entry lookup table (palette masks, mask_format = "palette", already hold class
+# indices and are read with palette_png), and each frame's confusion matrix is one np.bincount over the
+# paired label maps. Frame matrices are summed per video, per fold and overall, and
+# per-class IoU / Dice are reported at every level. Frames are scored in parallel.
+import os
+import csv
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from label_mappings import anatomy_label_mapping, auxtool_label_mapping, instrument_label_mapping
+from output_manifest import png_header
+from palette_png import read_palette_png
+
+# --- Gray-level label values per task (label_mappings.py, keyed by CSV prefix) ---
+task_label_mappings = {
+    "instrument": instrument_label_mapping,
+    "tool": auxtool_label_mapping,
+    "anatomy": anatomy_label_mapping,
+}
+
+# --- Evaluation settings ---
+task = "instrument"                        # "instrument", "tool" or "anatomy" (CSV prefix).
+dataset_base = "Lap_instrument_dataset"
+masks_base = os.path.join(dataset_base, "instrument_mask")
+num_folds = 4
+# Predictions per fold: a directory mirroring the mask tree (same relative paths and
+# file names as the ground truth), or an .npz store keyed by the relative mask path
+# without extension.
+prediction_sources = {i: f"predictions/fold_{i}" for i in range(num_folds)}
+prediction_encoding = "gray"   # "gray": same gray levels as the masks; "index": class indices.
+                               # Palette PNG predictions are always read as class indices.
+num_workers = 8
+output_prefix = f"Lap_{task}_eval"
+
+mask_label_mapping = task_label_mappings[task]
+class_names = ["background"] + list(mask_label_mapping)
+num_classes = len(class_names)
+
+# Gray level -> class index (unknown gray levels count as background).
+gray_to_class = np.zeros(256, dtype=np.int64)
+for k, value in enumerate(mask_label_mapping.values()):
+    gray_to_class[value] = k + 1
+
+def to_classes(label_map, encoding):
+    if encoding == "gray":
+        return gray_to_class[label_map]
+    # Out-of-range indices (e.g. 255 ignore values) count as background, like unknown gray levels.
+    label_map = label_map.astype(np.int64)
+    return np.where((label_map >= 0) & (label_map < num_classes), label_map, 0)
+
+def load_label_map(path, encoding):
+    """
+    Return (label map, encoding) of a mask file (None if missing or unreadable).
+
+    Palette-indexed PNGs are decoded to their class indices; OpenCV would expand them
+    to colors, so the PNG header is checked first.
+    """
+    header = png_header(path) if os.path.exists(path) else None
+    if header is not None and header[3] == 3:
+        return read_palette_png(path)[0], "index"
+    label_map = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if label_map is not None and label_map.ndim == 3:
+        label_map = label_map[..., 0]
+    return label_map, encoding
+
+def load_prediction(source, rel_mask_path):
+    """Return (predicted label map, encoding) for a frame (None if missing)."""
+    if isinstance(source, str):
+        return load_label_map(os.path.join(source, rel_mask_path), prediction_encoding)
+    key = os.path.splitext(rel_mask_path)[0]
+    # .npz stores are read lazily, one array per frame.
+    return (source[key] if key in source else None), prediction_encoding
+
+def frame_confusion(mask_path, source):
+    """Confusion matrix (rows = ground truth, columns = prediction) of one frame."""
+    if not os.path.exists(mask_path):
+        # json_to_mask_* always write PNG masks while the CSVs keep the image extension.
+        mask_path = os.path.splitext(mask_path)[0] + ".png"
+    gt, gt_encoding = load_label_map(mask_path, "gray")
+    if gt is None:
+        print(f"Warning: Could not load mask at {mask_path}")
+        return None
+    rel_mask_path = os.path.relpath(mask_path, os.path.abspath(masks_base))
+    pred, pred_encoding = load_prediction(source, rel_mask_path)
+    if pred is None:
+        print(f"Warning: No prediction for {rel_mask_path}")
+        return None
+    if pred.ndim == 3:
+        pred = pred[..., 0]
+    if pred.shape != gt.shape:
+        pred = cv2.resize(pred, (gt.shape[1], gt.shape[0]), interpolation=cv2.INTER_NEAREST)
+    pairs = to_classes(gt, gt_encoding) * num_classes + to_classes(pred, pred_encoding)
+    return np.bincount(pairs.ravel(), minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+
+def iou_dice(confusion):
+    """Per-class IoU and Dice from a confusion matrix (NaN for classes absent in both)."""
+    tp = np.diag(confusion).astype(np.float64)
+    fp = confusion.sum(axis=0) - tp
+    fn = confusion.sum(axis=1) - tp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = tp / (tp + fp + fn)
+        dice = 2 * tp / (2 * tp + fp + fn)
+    return iou, dice
+
+def metric_row(level, name, confusion):
+    iou, dice = iou_dice(confusion)
+    # Means over foreground classes that occur in either the ground truth or the prediction.
+    return ([level, name, np.nanmean(iou[1:]) if np.isfinite(iou[1:]).any() else np.nan,
+             np.nanmean(dice[1:]) if np.isfinite(dice[1:]).any() else np.nan]
+            + list(iou) + list(dice))
+
+header = (["level", "name", "mean_iou", "mean_dice"]
+          + [f"iou_{c}" for c in class_names] + [f"dice_{c}" for c in class_names])
+
+# --- Score every fold ---
+frame_rows, summary_rows = [], []
+overall = np.zeros((num_classes, num_classes), dtype=np.int64)
+for i in range(num_folds):
+    test_csv = f"Lap_{task}_test_{i}.csv"
+    with open(test_csv, newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    source = prediction_sources[i]
+    if source.endswith(".npz"):
+        with np.load(source) as npz, ThreadPoolExecutor(max_workers=num_workers) as pool:
+            confusions = list(pool.map(lambda row: frame_confusion(row["masks"], npz), rows))
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            confusions = list(pool.map(lambda row: frame_confusion(row["masks"], source), rows))
+
+    fold_total = np.zeros((num_classes, num_classes), dtype=np.int64)
+    video_totals = {}
+    for row, confusion in zip(rows, confusions):
+        if confusion is None:
+            continue
+        video = os.path.dirname(row["imgs"])
+        video_totals.setdefault(video, np.zeros_like(fold_total))
+        video_totals[video] += confusion
+        fold_total += confusion
+        frame_rows.append([i] + metric_row("frame", row["imgs"], confusion))
+
+    for video, confusion in sorted(video_totals.items()):
+        summary_rows.append([i] + metric_row("video", video, confusion))
+    summary_rows.append([i] + metric_row("fold", f"fold_{i}", fold_total))
+    overall += fold_total
+    fold_iou = summary_rows[-1][3]
+    print(f"Fold {i}: {sum(c is not None for c in confusions)}/{len(rows)} frames scored, mean IoU {fold_iou:.4f}")
+
+summary_rows.append(["all"] + metric_row("overall", "all_folds", overall))
+print(f"Overall mean IoU {summary_rows[-1][3]:.4f}, mean Dice {summary_rows[-1][4]:.4f}")
+
+# --- Save the reports ---
+for path, rows in [(f"{output_prefix}_frames.csv", frame_rows), (f"{output_prefix}_summary.csv", summary_rows)]:
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["fold"] + header)
+        writer.writerows(rows)
+    print(f"Saved evaluation report: {path}")
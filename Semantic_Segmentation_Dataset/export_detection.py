@@ -0,0 +1,161 @@
+# This script exports detection labels (COCO bounding boxes and YOLO txt files) for the
+# effective classes of one task, split by the folds of TrainIDs_generator_*.
+#
+# Boxes and areas come straight from the polygon vertices: all annotations of the task
+# are concatenated once and reduced per annotation over CSR offsets (see patch_store.py),
+# so no image or mask is decoded. Boxes are clipped to the frame; annotations whose box
+# is empty after clipping are skipped.
+#
+# Outputs in <output_base>:
+#   classes.txt                               class names, YOLO class id = line number
+#   yolo_labels/<rel_dir>/<base>.txt          "class cx cy w h" per box (normalized)
+#   fold_{i}/train.json, fold_{i}/test.json   COCO detection files of fold i
+#   fold_{i}/yolo_train.txt, yolo_test.txt    image lists of fold i
+import os
+import csv
+import json
+import numpy as np
+from label_mappings import label_sets
+from patch_store import annotation_areas, annotation_boxes
+
+# --- Task definitions (mappings and class order from label_mappings.py, as json_to_mask_*) ---
+detection_tasks = {
+    "instrument": {
+        "json_file": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json",
+        "input_base": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg",
+        "images_base": os.path.join("Lap_instrument_dataset", "instrument"),
+        "label_set": "instrument",
+    },
+    "tool": {
+        "json_file": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json",
+        "input_base": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg",
+        "images_base": os.path.join("Lap_tool_dataset", "tool"),
+        "label_set": "auxtool",
+    },
+    "anatomy": {
+        "json_file": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/anatomy.json",
+        "input_base": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/ganseg",
+        "images_base": os.path.join("Lap_anatomy_dataset", "ganseg"),
+        "label_set": "anatomy",
+    },
+}  # Adjust the paths as needed.
+
+# --- Export settings ---
+task_name = "instrument"     # "instrument", "tool" or "anatomy" (fold CSV prefix).
+num_folds = 4
+fold_csv_prefix = f"Lap_{task_name}"   # Lap_<task>_test_{i}.csv from TrainIDs_generator_*.
+output_base = f"Lap_{task_name}_detection"
+
+task = detection_tasks[task_name]
+mapping, labels = label_sets[task["label_set"]]
+classes = list(labels)
+class_id = {name: k for k, name in enumerate(classes)}
+
+# --- Fold assignment from the fold CSVs ---
+# A frame belongs to fold i when it is listed in Lap_<task>_test_{i}.csv; frames are
+# matched to the JSON by their path relative to the dataset image folder.
+images_base = os.path.abspath(task["images_base"])
+fold_of, dataset_path = {}, {}
+for i in range(num_folds):
+    with open(f"{fold_csv_prefix}_test_{i}.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            rel_path = os.path.relpath(row["imgs"], images_base)
+            fold_of[rel_path] = i
+            dataset_path[rel_path] = row["imgs"]
+
+# --- Load the annotations of the task's classes ---
+with open(task["json_file"], "r") as f:
+    data = json.load(f)
+
+input_base = task["input_base"]
+frames = []        # (image_id, rel_path, width, height) of every frame in a fold
+frame_index = {}   # image_id -> position in frames
+no_size = 0
+for img in data.get("images", []):
+    img_path = img["path"]
+    if img_path.startswith(input_base + os.sep):
+        rel_path = img_path[len(input_base + os.sep):]
+    else:
+        rel_path = img_path
+    if rel_path not in fold_of:
+        continue
+    if not img.get("width") or not img.get("height"):
+        no_size += 1  # Sizes come from the JSON only; frames are never decoded.
+        continue
+    frame_index[img["id"]] = len(frames)
+    frames.append((img["id"], rel_path, img["width"], img["height"]))
+
+anns = [ann for ann in data.get("annotations", [])
+        if ann.get("category_id") in mapping and ann["image_id"] in frame_index]
+print(f"{len(anns)} annotations on {len(frames)} fold frames "
+      f"({len(fold_of) - len(frames)} fold frames not usable, {no_size} without a size in the JSON).")
+
+# --- Boxes, areas and classes of all annotations at once ---
+boxes, valid = annotation_boxes(anns)
+areas = annotation_areas(anns)
+ann_frame = np.array([frame_index[ann["image_id"]] for ann in anns], dtype=np.int64)
+ann_class = np.array([class_id[mapping[ann["category_id"]]] for ann in anns], dtype=np.int64)
+frame_w = np.array([f[2] for f in frames], dtype=np.float64)
+frame_h = np.array([f[3] for f in frames], dtype=np.float64)
+
+w, h = frame_w[ann_frame], frame_h[ann_frame]
+x0 = np.clip(boxes[:, 0], 0, w)
+y0 = np.clip(boxes[:, 1], 0, h)
+x1 = np.clip(boxes[:, 2], 0, w)
+y1 = np.clip(boxes[:, 3], 0, h)
+keep = valid & (x1 > x0) & (y1 > y0)
+print(f"Skipped {int(np.count_nonzero(~keep))} annotations with an empty box inside the frame.")
+
+# Sort the kept boxes by frame so every frame's boxes are one contiguous run.
+order = np.flatnonzero(keep)
+order = order[np.argsort(ann_frame[order], kind="stable")]
+frame_starts = np.searchsorted(ann_frame[order], np.arange(len(frames) + 1))
+
+os.makedirs(output_base, exist_ok=True)
+with open(os.path.join(output_base, "classes.txt"), "w") as f:
+    f.write("\n".join(classes) + "\n")
+
+# --- YOLO labels (one file per frame, shared by all folds) ---
+yolo = np.stack([(x0 + x1) / 2 / w, (y0 + y1) / 2 / h, (x1 - x0) / w, (y1 - y0) / h], axis=1)
+label_root = os.path.join(output_base, "yolo_labels")
+for dir_path in sorted({os.path.dirname(rel_path) for _, rel_path, _, _ in frames}):
+    os.makedirs(os.path.join(label_root, dir_path), exist_ok=True)
+for k, (_, rel_path, _, _) in enumerate(frames):
+    run = order[frame_starts[k]:frame_starts[k + 1]]
+    lines = [f"{c} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}" for c, (cx, cy, bw, bh) in zip(ann_class[run], yolo[run])]
+    with open(os.path.join(label_root, os.path.splitext(rel_path)[0] + ".txt"), "w") as f:
+        f.write("".join(line + "\n" for line in lines))
+
+# --- COCO records ---
+coco_images = [{"id": image_id, "file_name": dataset_path[rel_path], "width": width, "height": height}
+               for image_id, rel_path, width, height in frames]
+coco_annotations = [{"id": anns[a].get("id", int(a) + 1),
+                     "image_id": anns[a]["image_id"],
+                     "category_id": int(ann_class[a]) + 1,
+                     "bbox": [round(float(x0[a]), 2), round(float(y0[a]), 2),
+                              round(float(x1[a] - x0[a]), 2), round(float(y1[a] - y0[a]), 2)],
+                     "area": round(float(areas[a]), 2),
+                     "iscrowd": 0}
+                    for a in order]
+coco_categories = [{"id": k + 1, "name": name} for k, name in enumerate(classes)]
+
+# --- Per-fold splits ---
+image_fold = np.array([fold_of[rel_path] for _, rel_path, _, _ in frames], dtype=np.int64)
+annotation_fold = image_fold[ann_frame[order]]
+for i in range(num_folds):
+    fold_dir = os.path.join(output_base, f"fold_{i}")
+    os.makedirs(fold_dir, exist_ok=True)
+    for split, in_split in [("train", image_fold != i), ("test", image_fold == i)]:
+        ann_in_split = (annotation_fold != i) if split == "train" else (annotation_fold == i)
+        coco = {
+            "images": [coco_images[k] for k in np.flatnonzero(in_split)],
+            "annotations": [coco_annotations[k] for k in np.flatnonzero(ann_in_split)],
+            "categories": coco_categories,
+        }
+        with open(os.path.join(fold_dir, f"{split}.json"), "w") as f:
+            json.dump(coco, f)
+        with open(os.path.join(fold_dir, f"yolo_{split}.txt"), "w") as f:
+            f.writelines(dataset_path[frames[k][1]] + "\n" for k in np.flatnonzero(in_split))
+        print(f"Fold {i} {split}: {len(coco['images'])} frames, {len(coco['annotations'])} boxes")
+
+print(f"Saved detection labels to {output_base}")
@@ -0,0 +1,111 @@
+# Streaming per-channel image statistics for the fold generators.
+#
+# Each frame is reduced to one 256-bin histogram per channel; count, sum and sum of
+# squares (float64) follow exactly from it. Frames are summed into per-patient partials
+# that are cached on disk, so every fold's train/test statistics are merged from the
+# cached partials and the images are decoded once in total, not once per fold.
+import os
+import json
+import hashlib
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+CHANNELS = "RGB"
+LEVELS = np.arange(256, dtype=np.float64)
+
+def image_histogram(path):
+    """(3, 256) per-channel histogram of an image in RGB order (None if unreadable)."""
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    # OpenCV decodes to BGR; report channels in RGB order as training code expects.
+    return np.stack([np.bincount(img[..., c].ravel(), minlength=256) for c in (2, 1, 0)])
+
+def empty_partial():
+    return {"frames": 0, "hist": np.zeros((3, 256), dtype=np.int64)}
+
+def merge_partials(partials):
+    """Sum a list of partials into one."""
+    merged = empty_partial()
+    for part in partials:
+        merged["frames"] += int(part["frames"])
+        merged["hist"] += part["hist"]
+    return merged
+
+def file_list_digest(paths):
+    """Digest of the file list with sizes and mtimes, used to validate cached partials."""
+    digest = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        digest.update(f"{path}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def patient_partial(image_paths, cache_file=None, workers=8):
+    """Histogram partial of one patient's frames, reusing cache_file if it is still valid."""
+    signature = file_list_digest(image_paths)
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file) as npz:
+            if str(npz["signature"]) == signature:
+                return {"frames": int(npz["frames"]), "hist": npz["hist"]}
+
+    partial = empty_partial()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, hist in zip(image_paths, pool.map(image_histogram, image_paths)):
+            if hist is None:
+                print(f"Warning: Could not load image at {path}")
+                continue
+            partial["frames"] += 1
+            partial["hist"] += hist
+
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+        np.savez(cache_file, signature=signature, frames=partial["frames"], hist=partial["hist"])
+    return partial
+
+def summarize(partial):
+    """Per-channel count, sum, sum of squares, mean and std (0-1 scale) of a partial."""
+    hist = partial["hist"].astype(np.float64)
+    count = hist.sum(axis=1)
+    total = hist @ LEVELS
+    total_sq = hist @ (LEVELS ** 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+    return {
+        "channels": CHANNELS,
+        "frames": int(partial["frames"]),
+        "pixels": count.tolist(),
+        "sum": total.tolist(),
+        "sum_sq": total_sq.tolist(),
+        "mean": (mean / 255).tolist(),
+        "std": (std / 255).tolist(),
+    }
+
+def fold_norm_stats(folds, patient_images, images_base, cache_dir, stats_json, hist_file):
+    """
+    Write train/test normalization statistics of every fold and of the whole dataset.
+
+    'folds' lists the patient directories of each fold and 'patient_images' maps each
+    patient directory to its image paths. Per-patient partials are cached in cache_dir
+    (one file per patient, named after its path relative to images_base); summaries go
+    to stats_json and the merged histograms to hist_file. Returns the summaries.
+    """
+    partials = {}
+    for patient, image_paths in patient_images.items():
+        rel_path = os.path.relpath(patient, images_base)
+        cache_file = os.path.join(cache_dir, rel_path.replace(os.sep, "__") + ".npz")
+        partials[patient] = patient_partial(image_paths, cache_file=cache_file)
+
+    stats, hists = {}, {}
+    for i in range(len(folds)):
+        for split, fold_ids in [("train", [j for j in range(len(folds)) if j != i]), ("test", [i])]:
+            merged = merge_partials([partials[p] for j in fold_ids for p in folds[j]])
+            stats.setdefault(f"fold_{i}", {})[split] = summarize(merged)
+            hists[f"fold_{i}_{split}"] = merged["hist"]
+    stats["all"] = summarize(merge_partials(partials.values()))
+
+    with open(stats_json, "w") as f:
+        json.dump(stats, f, indent=2)
+    np.savez(hist_file, channels=CHANNELS, **hists)
+    return stats
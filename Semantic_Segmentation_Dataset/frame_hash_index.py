@@ -0,0 +1,134 @@
+# Perceptual-hash index over dataset frames, used to find near-duplicate frames
+# (e.g. densely sampled neighbours or near-identical scenes from another GANSEG folder)
+# that would leak between the train and test sets of a fold.
+#
+# Each frame is reduced to a 64-bit difference hash (dHash) stored as one uint64.
+# Hamming distances are computed block-wise with XOR + a byte popcount table, so
+# comparing the ~11k instrument frames against each other takes seconds and never
+# runs an all-pairs Python loop. Hashes are cached on disk keyed by path and mtime.
+import os
+import csv
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of set bits for every byte value, used to popcount XOR-ed hashes.
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def dhash(img_path, hash_size=8):
+    """Return the 64-bit difference hash of an image as a Python int (None if unreadable)."""
+    # Decode at 1/8 resolution: the hash only looks at a 9x8 thumbnail anyway.
+    gray = cv2.imread(img_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def compute_hashes(img_paths, cache_file=None, workers=8):
+    """
+    Hash every image in img_paths and return (hashes, valid), two arrays aligned with it.
+
+    Unreadable images get a warning and valid=False; their hash slot (0) must not be
+    compared, since it would match every other failure and every flat frame. If
+    cache_file is given, hashes of files whose mtime did not change are reused from it
+    and the newly computed hashes are merged into it; failures are never cached, so
+    they are retried (and reported) on every run.
+    """
+    mtimes = [os.path.getmtime(p) for p in img_paths]
+    cached = {}
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file) as npz:
+            for path, mtime, h in zip(npz["paths"], npz["mtimes"], npz["hashes"]):
+                cached[str(path)] = (float(mtime), np.uint64(h))
+
+    hashes = np.zeros(len(img_paths), dtype=np.uint64)
+    valid = np.zeros(len(img_paths), dtype=bool)
+    todo = []
+    for k, (path, mtime) in enumerate(zip(img_paths, mtimes)):
+        hit = cached.get(path)
+        if hit is not None and hit[0] == mtime:
+            hashes[k] = hit[1]
+            valid[k] = True
+        else:
+            todo.append(k)
+
+    # cv2 releases the GIL while decoding, so a thread pool parallelises the misses.
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for k, h in zip(todo, pool.map(dhash, [img_paths[k] for k in todo])):
+            if h is None:
+                print(f"Warning: Could not load image at {img_paths[k]}")
+                cached.pop(img_paths[k], None)
+                continue
+            hashes[k] = np.uint64(h)
+            valid[k] = True
+            cached[img_paths[k]] = (mtimes[k], hashes[k])
+    print(f"Hashed {len(todo)} frames ({len(img_paths) - len(todo)} reused from cache, "
+          f"{int(np.count_nonzero(~valid))} unreadable).")
+
+    if cache_file and todo:
+        # Merge rather than overwrite, so runs on other tasks or subsets keep their entries.
+        paths = list(cached)
+        np.savez(cache_file,
+                 paths=np.array(paths),
+                 mtimes=np.array([cached[p][0] for p in paths], dtype=np.float64),
+                 hashes=np.array([cached[p][1] for p in paths], dtype=np.uint64))
+    return hashes, valid
+
+def hash_frames(img_paths, cache_file=None, workers=8):
+    """Map every readable image in img_paths to its hash (unreadable ones are left out)."""
+    hashes, valid = compute_hashes(img_paths, cache_file, workers)
+    return {path: h for path, h, ok in zip(img_paths, hashes, valid) if ok}
+
+def hamming_distances(query_hashes, ref_hashes):
+    """Return the (len(query), len(ref)) matrix of Hamming distances between uint64 hashes."""
+    xor = np.bitwise_xor(query_hashes[:, None], ref_hashes[None, :])
+    return POPCOUNT_TABLE[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def find_near_duplicates(query_hashes, ref_hashes, max_distance=6, block_size=512):
+    """
+    Find all (query, ref) pairs whose hashes differ in at most max_distance bits.
+
+    Returns three aligned arrays: query indices, ref indices and distances. The
+    distance matrix is built block_size query rows at a time to bound memory.
+    """
+    query_hashes = np.asarray(query_hashes, dtype=np.uint64)
+    ref_hashes = np.asarray(ref_hashes, dtype=np.uint64)
+    q_idx, r_idx, dists = [], [], []
+    for start in range(0, len(query_hashes), block_size):
+        dist = hamming_distances(query_hashes[start:start + block_size], ref_hashes)
+        rows, cols = np.nonzero(dist <= max_distance)
+        q_idx.append(rows + start)
+        r_idx.append(cols)
+        dists.append(dist[rows, cols])
+    if not q_idx:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.uint8)
+    return np.concatenate(q_idx), np.concatenate(r_idx), np.concatenate(dists)
+
+def check_fold_leakage(test_paths, train_paths, frame_hashes, leakage_csv, max_distance=6):
+    """
+    Report near-duplicate frames shared between a fold's test and train sets.
+
+    'frame_hashes' maps image paths to hashes (frames without one are skipped). Pairs
+    within max_distance bits are written to leakage_csv, which is always rewritten
+    (header only when there are none) so a report from an earlier run never lingers.
+    Returns the number of pairs.
+    """
+    test_paths = [p for p in test_paths if p in frame_hashes]
+    train_paths = [p for p in train_paths if p in frame_hashes]
+    test_hashes = np.array([frame_hashes[p] for p in test_paths], dtype=np.uint64)
+    train_hashes = np.array([frame_hashes[p] for p in train_paths], dtype=np.uint64)
+    q_idx, r_idx, dists = find_near_duplicates(test_hashes, train_hashes, max_distance)
+    with open(leakage_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["test_image", "train_image", "hamming_distance"])
+        for q, r, d in zip(q_idx, r_idx, dists):
+            writer.writerow([test_paths[q], train_paths[r], int(d)])
+    if len(q_idx):
+        print(f"Warning: {len(q_idx)} near-duplicate test/train frame pairs "
+              f"({len(np.unique(q_idx))} test frames), see {leakage_csv}")
+    else:
+        print(f"No leakage found: {len(test_paths)} test frames checked against "
+              f"{len(train_paths)} train frames ({leakage_csv})")
+    return len(q_idx)
@@ -0,0 +1,126 @@
+# Helpers for the pipelined execution mode of json_to_mask_* and json_to_overlay_*.
+#
+# The per-frame loop is split into three overlapping stages:
+#   reader  - prefetch_frames() decodes upcoming source frames on a thread pool,
+#   compute - the script's own loop rasterizes and blends (main thread),
+#   writer  - BackgroundWriter encodes and writes outputs on its own thread pool.
+# Both hand-offs are bounded (prefetch depth, pending writes), so memory stays capped
+# and a slow disk back-pressures the compute loop instead of piling up frames.
+# OpenCV releases the GIL while decoding, encoding and doing file I/O, so threads suffice.
+#
+# Frames are scheduled in on-disk order (video directory, then frame index) instead of
+# the JSON's annotation order, output directories are created once up front, and
+# readahead() can ask the kernel to start fetching upcoming frames early.
+import os
+import re
+import threading
+import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def frame_sort_key(img_path):
+    """Sort key ordering frames by video directory, then numerically by frame file name."""
+    video_dir, name = os.path.split(img_path)
+    parts = re.split(r"(\d+)", name)
+    return (video_dir, [int(p) if p.isdigit() else p for p in parts])
+
+def schedule_frames(image_ids, images_info):
+    """Order image_ids by their frames' on-disk location; ids without image info go last."""
+    known = sorted((i for i in image_ids if i in images_info),
+                   key=lambda i: frame_sort_key(images_info[i]["path"]))
+    return known + [i for i in image_ids if i not in images_info]
+
+def relative_dir(img_path, input_base):
+    """Directory of a frame relative to input_base (as mirrored in the output trees)."""
+    if img_path.startswith(input_base + os.sep):
+        img_path = img_path[len(input_base + os.sep):]
+    return os.path.dirname(img_path)
+
+def make_output_dirs(output_bases, rel_dirs):
+    """Create every output directory once, before the frame loop."""
+    for output_base in output_bases:
+        for rel_dir in sorted(set(rel_dirs)):
+            os.makedirs(os.path.join(output_base, rel_dir), exist_ok=True)
+
+def advise_willneed(path):
+    """Hint the kernel to start reading a file into the page cache (no-op where unsupported)."""
+    if not path or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+def readahead(paths, lookahead=8):
+    """Yield paths unchanged while issuing read-ahead hints 'lookahead' paths early."""
+    paths = list(paths)
+    for path in paths[:lookahead]:
+        advise_willneed(path)
+    for k, path in enumerate(paths):
+        if lookahead and k + lookahead < len(paths):
+            advise_willneed(paths[k + lookahead])
+        yield path
+
+def read_frame(path):
+    """Decode one source frame (None if the path is missing or unreadable)."""
+    return cv2.imread(path) if path else None
+
+def prefetch_frames(paths, workers=4, depth=16, read_fn=read_frame):
+    """Yield the decoded frame for every path, in order, reading up to 'depth' frames ahead."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append(pool.submit(read_fn, path))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def sequential_frames(paths, read_fn=read_frame):
+    """Yield the decoded frame for every path, reading each one only when it is needed."""
+    for path in paths:
+        yield read_fn(path)
+
+def write_now(fn, *args):
+    """Run a write immediately (sequential execution mode)."""
+    fn(*args)
+
+class BackgroundWriter:
+    """Run write calls on a thread pool with at most 'max_pending' writes in flight."""
+
+    def __init__(self, workers=4, max_pending=32):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+    def _done(self, future):
+        # Record the failure before freeing the slot, so drain() cannot return without it.
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+        self.slots.release()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args); blocks while 'max_pending' writes are still outstanding."""
+        self.slots.acquire()
+        self.pool.submit(fn, *args).add_done_callback(self._done)
+
+    def drain(self):
+        """Wait until every write queued so far has finished and re-raise the first failure."""
+        for _ in range(self.max_pending):
+            self.slots.acquire()
+        for _ in range(self.max_pending):
+            self.slots.release()
+        if self.errors:
+            raise self.errors[0]
+
+    def close(self):
+        """Wait for all queued writes and re-raise the first failure, if any."""
+        self.pool.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,63 @@
+# Layout and helpers for joint multi-label bitplane masks (see json_to_mask_joint.py).
+#
+# Every pixel is a uint32 in which each instrument, auxiliary tool and anatomy class
+# owns one bit, so overlapping labels (an instrument over the uterus, a thread over a
+# grasper) are all kept. Each label set occupies its own byte:
+#
+#   bits  0-7   instrument classes (mask_label_mapping order of json_to_mask_instrument.py)
+#   bits  8-15  auxiliary tool classes (json_to_mask_AuxTool.py)
+#   bits 16-23  anatomy classes (json_to_mask_anatomy.py)
+#
+# Joint masks are stored losslessly as 4-channel 8-bit PNGs holding the uint32 bytes.
+import cv2
+import numpy as np
+from label_mappings import anatomy_label_mapping, auxtool_label_mapping, instrument_label_mapping
+
+# Gray-level label values per class (label_mappings.py) and the bit offset of each label set.
+LABEL_SETS = {
+    "instrument": {"offset": 0, "classes": instrument_label_mapping},
+    "auxtool": {"offset": 8, "classes": auxtool_label_mapping},
+    "anatomy": {"offset": 16, "classes": anatomy_label_mapping},
+}
+
+def class_bit(label_set, class_name):
+    """Return the uint32 bit value of a class in the joint mask."""
+    spec = LABEL_SETS[label_set]
+    return np.uint32(1 << (spec["offset"] + list(spec["classes"]).index(class_name)))
+
+def write_joint_mask(path, joint):
+    """Save a (H, W) uint32 joint mask as a lossless 4-channel PNG."""
+    joint = np.ascontiguousarray(joint, dtype="<u4")
+    cv2.imwrite(path, joint.view(np.uint8).reshape(joint.shape + (4,)))
+
+def read_joint_mask(path):
+    """Load a joint mask PNG back into a (H, W) uint32 array."""
+    planes = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if planes is None:
+        raise FileNotFoundError(f"Could not load joint mask at {path}")
+    return np.ascontiguousarray(planes).view("<u4")[..., 0]
+
+def class_plane(joint, label_set, class_name):
+    """Boolean (H, W) plane of the pixels labelled with class_name."""
+    return (joint & class_bit(label_set, class_name)) != 0
+
+def _view_lut(label_set):
+    """Lookup table from a label set's byte to the gray value of its winning class."""
+    values = list(LABEL_SETS[label_set]["classes"].values())
+    lut = np.zeros(256, dtype=np.uint8)
+    for byte in range(1, 256):
+        top = byte.bit_length() - 1
+        lut[byte] = values[top] if top < len(values) else 0
+    return lut
+
+def single_label_view(joint, label_set):
+    """
+    Derive a single-label gray mask of one label set from a joint mask.
+
+    Same gray levels as json_to_mask_*, but not always the same pixels: the joint mask
+    does not record drawing order, so pixels carrying several classes of the set
+    resolve to the class that comes last in the mapping (the highest bit), whereas
+    json_to_mask_* keep the class of the last-drawn polygon.
+    """
+    byte = ((joint >> np.uint32(LABEL_SETS[label_set]["offset"])) & np.uint32(0xFF)).astype(np.uint8)
+    return _view_lut(label_set)[byte]
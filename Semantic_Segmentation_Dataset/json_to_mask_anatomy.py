@@ -1,28 +1,24 @@
 # This script processes a JSON file containing anatomy annotations
 # and generates multi class mask images for each anatomy class defined in the mapping.
 import os
+import csv
 import json
 import cv2
 import numpy as np
 from collections import defaultdict
+from annotation_query import read_subset_ids
+from frame_pipeline import (BackgroundWriter, make_output_dirs, prefetch_frames, readahead,
+                            relative_dir, schedule_frames, sequential_frames, write_now)
+from label_mappings import anatomy_mapping, anatomy_label_mapping
+from output_manifest import annotation_digest, pixel_digest, update_manifest
+from palette_png import hex2rgb, write_palette_png
+from polygon_sanitizer import PolygonCache
+from run_journal import RunJournal, atomic_write, sweep_temp_files
+from patch_store import annotation_boxes
 
 
-# --- Define the mask label mapping for the 3 anatomy classes ---
-mask_label_mapping = {
-    # "organ": 50,
-    "uterus": 85,
-    "tube": 170,
-    "ovary": 255,
-}
-
-# --- Define the effective mapping for anatomy annotations ---
-# These mappings merge the raw anatomy category IDs into the effective names.
-anatomy_mapping = {
-    # 19: "organ",
-    20: "uterus",
-    22: "tube",
-    23: "ovary",    
-}
+# --- Mask label values and effective mapping of the 3 anatomy classes (see label_mappings.py) ---
+mask_label_mapping = anatomy_label_mapping
 
 # --- Load the anatomy annotation JSON file ---
 json_file = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/anatomy.json"  # Adjust the path as needed.
@@ -42,6 +38,14 @@ for ann in data.get("annotations", []):
     if cat_id in anatomy_mapping:
         annotations_grouped[ann["image_id"]].append(ann)
 
+# --- Optional frame subset ---
+# A subset CSV written by annotation_query.write_subset(); only its image_ids are processed.
+image_subset_file = None
+if image_subset_file:
+    subset_ids = read_subset_ids(image_subset_file)
+    annotations_grouped = {i: anns for i, anns in annotations_grouped.items() if i in subset_ids}
+    print(f"Restricted to {len(annotations_grouped)} frames from {image_subset_file}")
+
 # --- Define base directories ---
 # 'input_base' is where the original images are stored.
 input_base = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/ganseg"  # Adjust if needed.
@@ -49,8 +53,111 @@ input_base = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/ganseg"  # Adj
 mask_output_base = "anatomy_mask"
 os.makedirs(mask_output_base, exist_ok=True)
 
+# --- Mask output format ---
+# "gray":    8-bit gray-level masks with the values of mask_label_mapping.
+# "palette": palette-indexed PNGs whose pixel values are contiguous class IDs
+#            (0 = background, then mask_label_mapping order) and whose embedded
+#            palette uses each class's annotation color, so one file serves both
+#            training and visual inspection (read with palette_png.read_palette_png).
+mask_format = "gray"
+class_index = {name: k + 1 for k, name in enumerate(mask_label_mapping)}
+
+if mask_format == "palette":
+    # Take each class's color from its first annotation (white if none carry one).
+    class_colors = {}
+    for ann_list in annotations_grouped.values():
+        for ann in ann_list:
+            class_colors.setdefault(anatomy_mapping.get(ann.get("category_id")), ann.get("color", "#FFFFFF"))
+    palette = [(0, 0, 0)] + [hex2rgb(class_colors.get(name, "#FFFFFF")) for name in mask_label_mapping]
+    palette_text = {"classes": ",".join(["background"] + list(mask_label_mapping))}
+
+# --- Per-frame class-presence index ---
+# Bit k of a frame's uint16 presence value is set when the k-th class of
+# mask_label_mapping is annotated in that frame. The index is saved next to the
+# masks and merged with the fold assignment by TrainIDs_generator_*.
+class_bit = {name: k for k, name in enumerate(mask_label_mapping)}
+presence_keys = []
+presence_bits = []
+
+# Checksum manifest rows of the masks written in this run (see verify_outputs.py).
+manifest_rows = []
+
+# --- Optional instance-ID maps ---
+# The same fill loop also draws a uint16 map with one ID per COCO annotation (1..N in
+# drawing order, 0 = background) and records each instance's effective class, visible
+# area and polygon bbox in <instance_output_base>/instance_table.csv.
+write_instances = False
+instance_output_base = "anatomy_instances"
+instance_rows = []
+
+# --- Polygon sanitization ---
+# Vertices are truncated to pixels as before and polygons with fewer than three
+# vertices are dropped; at polygon_tolerance 0 the masks are otherwise unchanged.
+# With polygon_tolerance > 0 (pixels) polygons are also clipped to the frame, stripped
+# of repeated and collinear vertices and simplified. Results are cached in
+# polygon_cache_file; with polygon_report the IoU of each sanitized polygon against
+# its raw raster is listed in <mask_output_base>/polygon_report.csv.
+polygon_tolerance = 0.0
+polygon_cache_file = "anatomy_polygons.npz"
+polygon_report = False
+polygon_cache = PolygonCache(polygon_cache_file, polygon_tolerance, polygon_report)
+
+# --- Execution mode ---
+# "sequential": read, rasterize and write each frame strictly one after another.
+# "pipelined":  prefetch source frames on reader threads and encode/write outputs on a
+#               writer thread pool, with bounded queues capping memory (see frame_pipeline.py).
+execution_mode = "sequential"
+prefetch_workers = 4
+prefetch_depth = 16
+write_workers = 4
+max_pending_writes = 32
+# Upcoming frames to hint to the kernel for read-ahead (0 = off). Each hint costs an extra
+# open/fadvise/close per frame on the main thread, so only turn it on for local disks
+# where cold reads dominate (e.g. 8), not on network storage.
+readahead_frames = 0
+
+# --- Crash safety and resume ---
+# Outputs are written to temporary files and renamed into place. Completed frames are
+# recorded in <mask_output_base>/run_journal.jsonl in batches (at least every
+# journal_max_interval seconds); with resume = True a rerun removes temporary files
+# left by the interrupted run and skips the recorded frames, re-processing the last
+# batch, and rebuilds the indexes below from the journal.
+resume = False
+journal_batch_size = 50
+journal_max_interval = 5.0
+
+# --- Frame schedule and output directories ---
+# Frames are processed in on-disk order (video directory, then frame index) rather than
+# JSON order, and the output directory tree is created once here instead of per frame.
+image_order = schedule_frames(list(annotations_grouped), images_info)
+journal = RunJournal(os.path.join(mask_output_base, "run_journal.jsonl"), resume,
+                     journal_batch_size, journal_max_interval)
+if resume:
+    image_order = [i for i in image_order if not journal.is_done(i)]
+    swept = sweep_temp_files([mask_output_base] + ([instance_output_base] if write_instances else []))
+    # Frames finished by earlier runs contribute their journaled index entries.
+    for record in journal.records.values():
+        presence_keys.append(record["presence_key"])
+        presence_bits.append(record["presence"])
+        manifest_rows.append(record["manifest"])
+        instance_rows.extend(record["instances"])
+    print(f"Resuming: {len(journal.records)} frames already done, {len(image_order)} left "
+          f"({swept} temporary files removed)")
+frame_paths = [images_info[i]["path"] if i in images_info else None for i in image_order]
+rel_dirs = [relative_dir(path, input_base) for path in frame_paths if path]
+make_output_dirs([mask_output_base] + ([instance_output_base] if write_instances else []), rel_dirs)
+if execution_mode == "pipelined":
+    frames = prefetch_frames(readahead(frame_paths, readahead_frames), prefetch_workers, prefetch_depth)
+    writer = BackgroundWriter(write_workers, max_pending_writes)
+    write_output = writer.submit
+    journal.before_flush = writer.drain  # Journal only frames whose writes have finished.
+else:
+    frames = sequential_frames(readahead(frame_paths, readahead_frames))
+    write_output = write_now
+
 # --- Process each image that has anatomy annotations ---
-for image_id, ann_list in annotations_grouped.items():
+for image_id, img in zip(image_order, frames):
+    ann_list = annotations_grouped[image_id]
     img_info = images_info.get(image_id)
     if not img_info:
         print(f"Warning: Image id {image_id} not found.")
@@ -62,8 +169,7 @@ for image_id, ann_list in annotations_grouped.items():
     width = img_info.get("width", None)
     height = img_info.get("height", None)
 
-    # Load the original image to determine dimensions (if not provided)
-    img = cv2.imread(img_path)
+    # The original image (decoded by the frame reader) determines dimensions if not provided.
     if img is None:
         print(f"Warning: Could not load image at {img_path}")
         continue
@@ -72,17 +178,25 @@ for image_id, ann_list in annotations_grouped.items():
 
     # Create a blank mask (background = 0)
     mask = np.zeros((height, width), dtype=np.uint8)
+    if write_instances:
+        instance_map = np.zeros((height, width), dtype=np.uint16)
+    presence = 0
 
     # For each annotation, draw the segmentation polygon with its label value.
-    for ann in ann_list:
+    for instance_id, ann in enumerate(ann_list, start=1):
         cat_id = ann.get("category_id")
         effective_name = anatomy_mapping.get(cat_id)
         # Get the label value from our mask label mapping.
-        label_value = mask_label_mapping.get(effective_name, 0)
-        segs = ann.get("segmentation", [])
-        for seg in segs:
-            pts = np.array(seg).reshape((-1, 2)).astype(np.int32)
+        if mask_format == "palette":
+            label_value = class_index.get(effective_name, 0)
+        else:
+            label_value = mask_label_mapping.get(effective_name, 0)
+        if effective_name in class_bit:
+            presence |= 1 << class_bit[effective_name]
+        for pts in polygon_cache.polygons(ann, width, height):
             cv2.fillPoly(mask, [pts], color=int(label_value))
+            if write_instances:
+                cv2.fillPoly(instance_map, [pts], color=instance_id)
 
     # Determine the relative directory structure from the input_base.
     if img_path.startswith(input_base + os.sep):
@@ -91,9 +205,8 @@ for image_id, ann_list in annotations_grouped.items():
         rel_path = img_path
     rel_dir = os.path.dirname(rel_path)
 
-    # Create the corresponding output directory for the masks.
+    # The corresponding output directory for the masks was created up front.
     out_dir = os.path.join(mask_output_base, rel_dir)
-    os.makedirs(out_dir, exist_ok=True)
 
     # Build the output file name: append "_mask" to the original file name.
     base, ext = os.path.splitext(file_name)
@@ -101,5 +214,76 @@ for image_id, ann_list in annotations_grouped.items():
     out_path = os.path.join(out_dir, out_file_name)
 
     # Save the mask image (8-bit single channel)
-    cv2.imwrite(out_path, mask)
-    print(f"Saved anatomy mask: {out_path}")
\ No newline at end of file
+    if mask_format == "palette":
+        write_output(atomic_write, write_palette_png, out_path, mask, palette, palette_text)
+    else:
+        write_output(atomic_write, cv2.imwrite, out_path, mask)
+    print(f"Saved anatomy mask: {out_path}")
+
+    # Save the instance map and add this frame's instances to the instance table.
+    frame_instances = []
+    if write_instances:
+        instance_dir = os.path.join(instance_output_base, rel_dir)
+        write_output(atomic_write, cv2.imwrite, os.path.join(instance_dir, f"{base}_instances.png"), instance_map)
+        # Visible area (later polygons overwrite earlier ones) and polygon bbox per instance.
+        areas = np.bincount(instance_map.ravel(), minlength=len(ann_list) + 1)
+        boxes, valid = annotation_boxes(ann_list)
+        boxes = np.clip(boxes, 0, [width - 1, height - 1, width - 1, height - 1])
+        for instance_id, ann in enumerate(ann_list, start=1):
+            bbox = [round(float(v), 1) for v in boxes[instance_id - 1]] if valid[instance_id - 1] else [""] * 4
+            frame_instances.append([image_id, os.path.join(rel_dir, base), instance_id, ann.get("id"),
+                                    anatomy_mapping.get(ann.get("category_id")), int(areas[instance_id])] + bbox)
+        instance_rows.extend(frame_instances)
+
+    manifest_row = {
+        "mask_path": os.path.join(rel_dir, out_file_name),
+        "image_id": image_id,
+        "annotation_digest": annotation_digest(ann_list),
+        "width": width,
+        "height": height,
+        "format": mask_format,
+        "pixel_digest": pixel_digest(mask),
+    }
+    manifest_rows.append(manifest_row)
+
+    # Key the presence value by the frame's relative path without extension.
+    presence_keys.append(os.path.join(rel_dir, base))
+    presence_bits.append(presence)
+
+    journal.mark(image_id, {"presence_key": presence_keys[-1], "presence": presence,
+                            "manifest": manifest_row, "instances": frame_instances})
+
+# --- Wait for the writer stage to finish ---
+if execution_mode == "pipelined":
+    writer.close()
+journal.close()
+
+# --- Save the instance table ---
+if write_instances:
+    instance_table = os.path.join(instance_output_base, "instance_table.csv")
+    with open(instance_table, "w", newline="") as f:
+        writer_csv = csv.writer(f)
+        writer_csv.writerow(["image_id", "frame", "instance_id", "annotation_id", "class_name",
+                             "area", "x_min", "y_min", "x_max", "y_max"])
+        writer_csv.writerows(instance_rows)
+    print(f"Saved instance table with {len(instance_rows)} instances: {instance_table}")
+
+# --- Save the polygon cache (and report) ---
+polygon_cache.save()
+if polygon_report:
+    report_path = os.path.join(mask_output_base, "polygon_report.csv")
+    polygon_cache.write_report(report_path)
+    print(f"Saved polygon report: {report_path}")
+
+# --- Update the checksum manifest ---
+manifest_file = os.path.join(mask_output_base, "manifest.csv")
+update_manifest(manifest_file, manifest_rows)
+print(f"Updated mask manifest with {len(manifest_rows)} masks: {manifest_file}")
+
+# --- Save the class-presence index ---
+presence_file = os.path.join(mask_output_base, "class_presence.npz")
+np.savez(presence_file,
+         keys=np.array(presence_keys),
+         presence=np.array(presence_bits, dtype=np.uint16),
+         class_names=np.array(list(mask_label_mapping)))
+print(f"Saved class-presence index for {len(presence_keys)} frames: {presence_file}")
@@ -0,0 +1,106 @@
+# This script rasterizes instrument, auxiliary tool and anatomy annotations in a single
+# pass into joint multi-label masks: one uint32 per pixel with one bit per class
+# (layout in joint_mask.py), so overlaps between classes and label sets are kept.
+# joint_mask.single_label_view derives single-label masks from them. Where classes of
+# one label set overlap it keeps the class with the highest bit, while json_to_mask_*
+# keep the last-drawn polygon, so those pixels can differ from the json_to_mask_* output.
+import os
+import json
+import cv2
+import numpy as np
+from collections import defaultdict
+from frame_pipeline import frame_sort_key, make_output_dirs
+from joint_mask import class_bit, write_joint_mask
+from label_mappings import AuxTool_mapping, Instrument_mapping, anatomy_mapping
+from polygon_sanitizer import PolygonCache
+
+
+# --- Annotation sources ---
+# Each source: (JSON file, base directory of its images, [(label set, effective mapping)]).
+sources = [
+    ("/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json",
+     "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg",
+     [("instrument", Instrument_mapping), ("auxtool", AuxTool_mapping)]),
+    ("/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/anatomy.json",
+     "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/ganseg",
+     [("anatomy", anatomy_mapping)]),
+]  # Adjust the paths as needed.
+
+# 'mask_output_base' is where the joint masks will be saved.
+mask_output_base = "joint_mask"
+os.makedirs(mask_output_base, exist_ok=True)
+
+# --- Polygon sanitization (same stage as json_to_mask_*) ---
+polygon_tolerance = 0.0
+polygon_cache = PolygonCache("joint_polygons.npz", polygon_tolerance)
+
+# --- Collect the annotations of every frame across all sources ---
+# Frames are matched across JSON files by their path relative to the source's image base.
+frames = {}
+frame_annotations = defaultdict(list)
+for json_file, input_base, label_sets in sources:
+    with open(json_file, "r") as f:
+        data = json.load(f)
+    images_info = {img["id"]: img for img in data.get("images", [])}
+
+    for ann in data.get("annotations", []):
+        img_info = images_info.get(ann["image_id"])
+        if not img_info:
+            continue
+        bit = None
+        for label_set, mapping in label_sets:
+            effective_name = mapping.get(ann.get("category_id"))
+            if effective_name is not None:
+                bit = class_bit(label_set, effective_name)
+                break
+        if bit is None:
+            continue
+
+        img_path = img_info["path"]
+        if img_path.startswith(input_base + os.sep):
+            rel_path = img_path[len(input_base + os.sep):]
+        else:
+            rel_path = img_path
+        frames.setdefault(rel_path, img_info)
+        frame_annotations[rel_path].append((bit, ann))
+
+print(f"Collected annotations for {len(frame_annotations)} frames.")
+
+# --- Rasterize every frame once ---
+# Frames are processed in on-disk order and the output tree is created up front.
+frame_order = sorted(frame_annotations, key=frame_sort_key)
+make_output_dirs([mask_output_base], [os.path.dirname(rel_path) for rel_path in frame_order])
+for rel_path in frame_order:
+    annotations = frame_annotations[rel_path]
+    img_info = frames[rel_path]
+    file_name = img_info.get("file_name", os.path.basename(img_info["path"]))
+    width = img_info.get("width", None)
+    height = img_info.get("height", None)
+
+    # Only decode the frame when the JSON does not provide its size.
+    if width is None or height is None:
+        img = cv2.imread(img_info["path"])
+        if img is None:
+            print(f"Warning: Could not load image at {img_info['path']}")
+            continue
+        height, width = img.shape[:2]
+
+    # Fill each polygon into a scratch plane and OR its class bit into the joint mask.
+    joint = np.zeros((height, width), dtype=np.uint32)
+    scratch = np.zeros((height, width), dtype=np.uint8)
+    for bit, ann in annotations:
+        for pts in polygon_cache.polygons(ann, width, height):
+            scratch[:] = 0
+            cv2.fillPoly(scratch, [pts], color=1)
+            joint[scratch.view(bool)] |= bit
+
+    # Mirror the source directory structure and append "_joint" to the file name.
+    out_dir = os.path.join(mask_output_base, os.path.dirname(rel_path))
+    base, ext = os.path.splitext(file_name)
+    out_path = os.path.join(out_dir, f"{base}_joint.png")
+
+    write_joint_mask(out_path, joint)
+    print(f"Saved joint mask: {out_path}")
+
+# --- Save the polygon cache ---
+polygon_cache.save()
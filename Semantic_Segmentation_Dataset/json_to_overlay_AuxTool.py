@@ -1,9 +1,18 @@
 
 import os
+import csv
 import json
 import cv2
 import numpy as np
 from collections import defaultdict
+from annotation_query import read_subset_ids
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from content_store import export_original
+from frame_pipeline import (BackgroundWriter, frame_sort_key, make_output_dirs, prefetch_frames,
+                            readahead, relative_dir, schedule_frames, sequential_frames, write_now)
+from label_mappings import AuxTool_mapping, hex2bgr
+from polygon_sanitizer import PolygonCache
+from run_journal import RunJournal, atomic_write, sweep_temp_files
 
 #----------------------
 # These are all the instruments in the "instrument.json" file, which we consider them as two seperate categories, "Instrument" and "Auxiliary tool"
@@ -33,30 +42,6 @@ from collections import defaultdict
 # morcellator (ID: 4): 292          # "Auxiliary tool"
 #_________________________________
 
-def hex2bgr(hex_color):
-    """Convert hex color (e.g. '#3fe50f') to a BGR tuple for OpenCV."""
-    hex_color = hex_color.lstrip('#')
-    if len(hex_color) != 6:
-        return (255, 255, 255)
-    r = int(hex_color[0:2], 16)
-    g = int(hex_color[2:4], 16)
-    b = int(hex_color[4:6], 16)
-    return (b, g, r)
-
-# --- Define the effective mapping for Auxiliary tool categories ---
-# These are the only categories we consider for the "Auxiliary tool" dataset.
-# For merged classes, all annotations belonging to any of the IDs below
-# will be labeled as the merged class name.
-AuxTool_mapping = {
-    # Remain as individual classes:
-    4: "morcellator",
-    9: "thread",
-    27: "trocar-sleeve",
-    # Merged as "cannula":
-    14: "cannula",
-    28:  "cannula",
-}
-
 # --- Load JSON file ---
 json_file = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json"  # Adjust this path as needed.
 with open(json_file, 'r') as f:
@@ -75,38 +60,69 @@ for ann in data.get("annotations", []):
     if cat_id in AuxTool_mapping:
         annotations_grouped[ann["image_id"]].append(ann)
 
+# --- Optional frame subset ---
+# A subset CSV written by annotation_query.write_subset(); only its image_ids are processed.
+image_subset_file = None
+if image_subset_file:
+    subset_ids = read_subset_ids(image_subset_file)
+    annotations_grouped = {i: anns for i, anns in annotations_grouped.items() if i in subset_ids}
+    print(f"Restricted to {len(annotations_grouped)} frames from {image_subset_file}")
+
 # --- Define base directories ---
 # 'input_base' is where the original images are stored.
 input_base = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg"  # Adjust this path as needed.
 # Output directories for overlays and for copying the original images.
 overlay_output_base = "auxtool_overlays"
+# Originals are stored once, by content hash, in a store shared by all overlay scripts
+# and linked into original_output_base (None: write plain re-encoded copies instead).
+original_store = "originals_store"
 original_output_base = "auxtool_originals"
-os.makedirs(overlay_output_base, exist_ok=True)
-os.makedirs(original_output_base, exist_ok=True)
+
+# --- Output mode ---
+# "images": write one "<base>_annotated<ext>" overlay (plus a copy of the original) per frame.
+# "video":  stream each video's frames, in frame order, into one overlay movie per video
+#           directory, with a CSV sidecar mapping video timestamps back to image_id and file_name.
+# "preview": write reduced-resolution contact sheets per video instead (see below).
+output_mode = "images"
+video_output_base = "auxtool_overlay_videos"
+video_fps = 5          # Playback rate of the review movies (frames are sparsely sampled).
+video_fourcc = "mp4v"
+preview_output_base = "auxtool_previews"
+preview_reduce = 4              # Decode downscale factor: 1, 2, 4 or 8.
+preview_frames_per_video = 48   # Evenly spaced frames tiled per video (None = all frames).
+preview_columns = 8             # Tiles per contact-sheet row.
+preview_rows = 6                # Rows per contact sheet; longer selections get several sheets.
+preview_workers = 8             # Videos rendered in parallel (OpenCV releases the GIL).
+
+if output_mode == "video":
+    os.makedirs(video_output_base, exist_ok=True)
+elif output_mode == "preview":
+    os.makedirs(preview_output_base, exist_ok=True)
+else:
+    os.makedirs(overlay_output_base, exist_ok=True)
+    os.makedirs(original_output_base, exist_ok=True)
 
 # Blending factor for the overlay polygons.
 alpha = 0.4
 
-# --- Process each image that has annotations ---
-for image_id, ann_list in annotations_grouped.items():
-    img_info = images_info.get(image_id)
-    if not img_info:
-        print(f"Warning: Image id {image_id} not found in images info.")
-        continue
+# --- Polygon sanitization ---
+# Same stage as json_to_mask_* (clipping, vertex clean-up and simplification only with
+# polygon_tolerance > 0), sharing its cache file; degenerate polygons are not drawn.
+polygon_tolerance = 0.0
+polygon_cache = PolygonCache("auxtool_polygons.npz", polygon_tolerance)
 
-    # Get image details from JSON.
-    img_path = img_info["path"]  
-    file_name = img_info.get("file_name", os.path.basename(img_path))
-    width = img_info.get("width", None)
-    height = img_info.get("height", None)
+# --- Overlay compositing ---
+def composite_overlay(original_img, ann_list, scale=1.0):
+    """
+    Blend every segmentation polygon in ann_list onto a copy of original_img.
 
-    # Load the original image.
-    original_img = cv2.imread(img_path)
-    if original_img is None:
-        print(f"Warning: Could not load image at {img_path}")
-        continue
-    if width is None or height is None:
-        height, width = original_img.shape[:2]
+    'scale' maps JSON pixel coordinates onto original_img when it was decoded at
+    reduced resolution (preview mode). Returns the overlay image and the set of
+    effective instrument names present in the frame.
+    """
+    # Polygons are sanitized in full-resolution frame coordinates.
+    frame_height = int(round(original_img.shape[0] / scale))
+    frame_width = int(round(original_img.shape[1] / scale))
 
     # Create an overlay image as a copy of the original.
     overlay_img = original_img.copy()
@@ -125,9 +141,9 @@ for image_id, ann_list in annotations_grouped.items():
         bgr_color = hex2bgr(hex_color)
 
         # Process each segmentation polygon.
-        segs = ann.get("segmentation", [])
-        for seg in segs:
-            pts = np.array(seg).reshape((-1, 2)).astype(np.int32)
+        for pts in polygon_cache.polygons(ann, frame_width, frame_height):
+            if scale != 1.0:
+                pts = (pts * scale).astype(np.int32)
             # Create a temporary overlay to fill the polygon.
             temp_overlay = overlay_img.copy()
             cv2.fillPoly(temp_overlay, [pts], bgr_color)
@@ -143,6 +159,90 @@ for image_id, ann_list in annotations_grouped.items():
             #     cv2.putText(overlay_img, effective_name, (centroid[0], centroid[1]),
             #                 cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), thickness=1, lineType=cv2.LINE_AA)
 
+    return overlay_img, unique_instruments
+
+# --- Determine processing order ---
+# Frames are processed in on-disk order (video directory, then frame index) rather than
+# JSON order; the video mode also relies on this to keep each video's frames contiguous.
+image_order = schedule_frames(list(annotations_grouped), images_info)
+if output_mode == "preview":
+    image_order = []  # Contact sheets are built per video at the end of the script.
+
+# --- Execution mode ---
+# "sequential": read, blend and write each frame strictly one after another.
+# "pipelined":  prefetch source frames on reader threads and encode/write outputs on a
+#               writer thread pool, with bounded queues capping memory (see frame_pipeline.py).
+execution_mode = "sequential"
+prefetch_workers = 4
+prefetch_depth = 16
+write_workers = 4
+max_pending_writes = 32
+# Upcoming frames to hint to the kernel for read-ahead (0 = off). Each hint costs an extra
+# open/fadvise/close per frame on the main thread, so only turn it on for local disks
+# where cold reads dominate (e.g. 8), not on network storage.
+readahead_frames = 0
+
+# --- Crash safety and resume (images mode) ---
+# Overlays are written to temporary files and renamed into place. Completed frames are
+# recorded in <overlay_output_base>/run_journal.jsonl in batches (at least every
+# journal_max_interval seconds); with resume = True a rerun removes temporary files
+# left by the interrupted run and skips the recorded frames, re-processing the last batch.
+resume = False
+journal_batch_size = 50
+journal_max_interval = 5.0
+journal = None
+if output_mode == "images":
+    journal = RunJournal(os.path.join(overlay_output_base, "run_journal.jsonl"), resume,
+                         journal_batch_size, journal_max_interval)
+    if resume:
+        image_order = [i for i in image_order if not journal.is_done(i)]
+        swept = sweep_temp_files([overlay_output_base, original_output_base])
+        print(f"Resuming: {len(journal.records)} frames already done, {len(image_order)} left "
+              f"({swept} temporary files removed)")
+
+frame_paths = [images_info[i]["path"] if i in images_info else None for i in image_order]
+if output_mode == "images":
+    # Create the output directory trees once instead of per frame.
+    make_output_dirs([overlay_output_base, original_output_base],
+                     [relative_dir(path, input_base) for path in frame_paths if path])
+if execution_mode == "pipelined":
+    frames = prefetch_frames(readahead(frame_paths, readahead_frames), prefetch_workers, prefetch_depth)
+    writer = BackgroundWriter(write_workers, max_pending_writes)
+    write_output = writer.submit
+    if journal:
+        journal.before_flush = writer.drain  # Journal only frames whose writes have finished.
+else:
+    frames = sequential_frames(readahead(frame_paths, readahead_frames))
+    write_output = write_now
+
+# State of the currently open overlay movie (video mode only).
+current_video = None
+video_writer = None
+index_f = None
+
+# --- Process each image that has annotations ---
+for image_id, original_img in zip(image_order, frames):
+    ann_list = annotations_grouped[image_id]
+    img_info = images_info.get(image_id)
+    if not img_info:
+        print(f"Warning: Image id {image_id} not found in images info.")
+        continue
+
+    # Get image details from JSON.
+    img_path = img_info["path"]  
+    file_name = img_info.get("file_name", os.path.basename(img_path))
+    width = img_info.get("width", None)
+    height = img_info.get("height", None)
+
+    # The original image is decoded by the frame reader.
+    if original_img is None:
+        print(f"Warning: Could not load image at {img_path}")
+        continue
+    if width is None or height is None:
+        height, width = original_img.shape[:2]
+
+    overlay_img, unique_instruments = composite_overlay(original_img, ann_list)
+
     # Determine the relative directory (subfolder structure) from the input_base.
     if img_path.startswith(input_base + os.sep):
         rel_path = img_path[len(input_base + os.sep):]
@@ -150,11 +250,38 @@ for image_id, ann_list in annotations_grouped.items():
         rel_path = img_path
     rel_dir = os.path.dirname(rel_path)
 
-    # Create corresponding output directories for overlays and originals.
+    if output_mode == "video":
+        # Start a new movie whenever the loop moves on to the next video directory.
+        if rel_dir != current_video:
+            if video_writer is not None:
+                video_writer.release()
+                index_f.close()
+                print(f"Saved auxtool overlay video: {video_path}")
+            current_video = rel_dir
+            video_dir = os.path.join(video_output_base, rel_dir)
+            os.makedirs(video_dir, exist_ok=True)
+            video_path = os.path.join(video_dir, "overlay.mp4")
+            video_size = (overlay_img.shape[1], overlay_img.shape[0])
+            video_writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*video_fourcc),
+                                           video_fps, video_size)
+            if not video_writer.isOpened():
+                raise RuntimeError(f"Could not open video writer for {video_path} (fourcc {video_fourcc})")
+            index_f = open(os.path.join(video_dir, "overlay_index.csv"), "w", newline="")
+            index_writer = csv.writer(index_f)
+            index_writer.writerow(["frame_index", "timestamp_sec", "image_id", "file_name"])
+            frame_index = 0
+
+        # All frames of one movie must share the size of its first frame.
+        if (overlay_img.shape[1], overlay_img.shape[0]) != video_size:
+            overlay_img = cv2.resize(overlay_img, video_size, interpolation=cv2.INTER_AREA)
+        video_writer.write(overlay_img)
+        index_writer.writerow([frame_index, f"{frame_index / video_fps:.3f}", image_id, file_name])
+        frame_index += 1
+        continue
+
+    # Output directories for overlays and originals (created up front).
     overlay_out_dir = os.path.join(overlay_output_base, rel_dir)
-    os.makedirs(overlay_out_dir, exist_ok=True)
     original_out_dir = os.path.join(original_output_base, rel_dir)
-    os.makedirs(original_out_dir, exist_ok=True)
 
     # Build the output file name for the overlay image.
     sorted_instruments = "_".join(sorted(unique_instruments))
@@ -163,10 +290,108 @@ for image_id, ann_list in annotations_grouped.items():
     overlay_out_path = os.path.join(overlay_out_dir, overlay_file_name)
     
     # Save the overlay image.
-    cv2.imwrite(overlay_out_path, overlay_img)
+    write_output(atomic_write, cv2.imwrite, overlay_out_path, overlay_img)
     print(f"Saved instrument overlay: {overlay_out_path}")
     
     # Also save (or copy) the original image in the new folder structure.
     original_out_path = os.path.join(original_out_dir, file_name)
-    cv2.imwrite(original_out_path, original_img)
-    print(f"Copied original instrument image: {original_out_path}")
\ No newline at end of file
+    if original_store:
+        write_output(export_original, img_path, original_out_path, original_store)
+    else:
+        write_output(atomic_write, cv2.imwrite, original_out_path, original_img)
+    print(f"Copied original instrument image: {original_out_path}")
+    journal.mark(image_id)
+
+# --- Wait for the writer stage to finish ---
+if execution_mode == "pipelined":
+    writer.close()
+if journal:
+    journal.close()
+
+# --- Finalize the last overlay movie ---
+if video_writer is not None:
+    video_writer.release()
+    index_f.close()
+    print(f"Saved auxtool overlay video: {video_path}")
+
+# --- Preview mode: reduced-resolution contact sheets ---
+# Frames are decoded directly at 1/preview_reduce resolution (JPEG DCT-domain downscaling),
+# composited at that size and tiled into contact-sheet mosaics, one set per video,
+# each tile captioned with its image_id and the classes present.
+reduced_read_flags = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+caption_height = 28
+
+def render_preview_tile(image_id):
+    """Decode one frame at reduced resolution and return its captioned overlay tile (or None)."""
+    img_info = images_info[image_id]
+    img_path = img_info["path"]
+    small_img = cv2.imread(img_path, reduced_read_flags[preview_reduce])
+    if small_img is None:
+        print(f"Warning: Could not load image at {img_path}")
+        return None
+    width = img_info.get("width") or small_img.shape[1] * preview_reduce
+    scale = small_img.shape[1] / width
+    overlay_img, unique_instruments = composite_overlay(small_img, annotations_grouped[image_id], scale)
+
+    caption = np.zeros((caption_height, overlay_img.shape[1], 3), dtype=np.uint8)
+    cv2.putText(caption, f"id {image_id}", (3, 11),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.35, (255, 255, 255), thickness=1, lineType=cv2.LINE_AA)
+    cv2.putText(caption, ",".join(sorted(unique_instruments)), (3, 24),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.3, (200, 200, 200), thickness=1, lineType=cv2.LINE_AA)
+    return np.vstack([overlay_img, caption])
+
+def build_contact_sheets(video_dir, image_ids):
+    """Render the sampled frames of one video and save them as contact-sheet mosaics."""
+    if preview_frames_per_video and len(image_ids) > preview_frames_per_video:
+        picks = np.linspace(0, len(image_ids) - 1, preview_frames_per_video).round().astype(int)
+        image_ids = [image_ids[k] for k in picks]
+
+    tiles = [tile for tile in map(render_preview_tile, image_ids) if tile is not None]
+    if not tiles:
+        return []
+    tile_h, tile_w = tiles[0].shape[:2]
+
+    out_dir = os.path.join(preview_output_base, video_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    per_sheet = preview_columns * preview_rows
+    saved = []
+    for sheet_idx, start in enumerate(range(0, len(tiles), per_sheet)):
+        chunk = tiles[start:start + per_sheet]
+        n_rows = -(-len(chunk) // preview_columns)
+        sheet = np.zeros((n_rows * tile_h, preview_columns * tile_w, 3), dtype=np.uint8)
+        for k, tile in enumerate(chunk):
+            if tile.shape[:2] != (tile_h, tile_w):
+                tile = cv2.resize(tile, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+            r, c = divmod(k, preview_columns)
+            sheet[r * tile_h:(r + 1) * tile_h, c * tile_w:(c + 1) * tile_w] = tile
+        out_path = os.path.join(out_dir, f"contact_sheet_{sheet_idx:03d}.jpg")
+        cv2.imwrite(out_path, sheet)
+        saved.append(out_path)
+    return saved
+
+if output_mode == "preview":
+    # Group the annotated frames per video directory, in frame order.
+    preview_videos = defaultdict(list)
+    known_ids = [i for i in annotations_grouped if i in images_info]
+    for image_id in sorted(known_ids, key=lambda i: frame_sort_key(images_info[i]["path"])):
+        img_path = images_info[image_id]["path"]
+        if img_path.startswith(input_base + os.sep):
+            rel_path = img_path[len(input_base + os.sep):]
+        else:
+            rel_path = img_path
+        preview_videos[os.path.dirname(rel_path)].append(image_id)
+
+    with ThreadPoolExecutor(max_workers=preview_workers) as pool:
+        futures = [pool.submit(build_contact_sheets, video_dir, ids)
+                   for video_dir, ids in preview_videos.items()]
+        for future in as_completed(futures):
+            for out_path in future.result():
+                print(f"Saved auxtool contact sheet: {out_path}")
+
+# --- Save the polygon cache ---
+polygon_cache.save()
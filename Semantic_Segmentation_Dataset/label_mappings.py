@@ -0,0 +1,80 @@
+# Label tables shared by every script that rasterizes, renders, exports or scores
+# annotations, so all of them agree on the classes.
+#
+# *_mapping merge the raw COCO category IDs into the effective class names; the
+# *_label_mapping give each effective class its gray level in the single-label masks.
+# The order of a label mapping is the class order everywhere else (palette index,
+# class-presence bit, joint-mask bit, detection class id).
+
+# --- Instrument classes (instruments.json) ---
+Instrument_mapping = {
+    # Remain as individual classes:
+    2: "grasper",
+    10: "scissors",
+    3: "irrigator",
+    5: "bipolar-forceps",
+    7: "sealer-divider",
+    11: "hook",
+    # Merged as "suturing-instrument":
+    12: "suturing-instrument",
+    6:  "suturing-instrument",
+    13: "suturing-instrument",
+    16: "suturing-instrument",
+}
+instrument_label_mapping = {
+    "grasper": 36,
+    "scissors": 73,
+    "irrigator": 109,
+    "bipolar-forceps": 146,
+    "sealer-divider": 182,
+    "hook": 219,
+    "suturing-instrument": 255,
+}
+
+# --- Auxiliary tool classes (instruments.json) ---
+AuxTool_mapping = {
+    # Remain as individual classes:
+    4: "morcellator",
+    9: "thread",
+    27: "trocar-sleeve",
+    # Merged as "cannula":
+    14: "cannula",
+    28:  "cannula",
+}
+auxtool_label_mapping = {
+    "morcellator": 60,
+    "thread": 85,
+    "trocar-sleeve": 170,
+    "cannula": 255,
+}
+
+# --- Anatomy classes (anatomy.json) ---
+anatomy_mapping = {
+    # 19: "organ",
+    20: "uterus",
+    22: "tube",
+    23: "ovary",
+}
+anatomy_label_mapping = {
+    # "organ": 50,
+    "uterus": 85,
+    "tube": 170,
+    "ovary": 255,
+}
+
+# (effective mapping, mask label mapping) per label set.
+label_sets = {
+    "instrument": (Instrument_mapping, instrument_label_mapping),
+    "auxtool": (AuxTool_mapping, auxtool_label_mapping),
+    "anatomy": (anatomy_mapping, anatomy_label_mapping),
+}
+
+def hex2bgr(hex_color):
+    """Convert hex color (e.g. '#3fe50f') to a BGR tuple for OpenCV."""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) != 6:
+        return (255, 255, 255)
+    r = int(hex_color[0:2], 16)
+    g = int(hex_color[2:4], 16)
+    b = int(hex_color[4:6], 16)
+    return (b, g, r)
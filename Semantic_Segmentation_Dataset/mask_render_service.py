@@ -0,0 +1,267 @@
+# This script runs a local HTTP service that renders masks, overlays and annotation
+# crops on demand instead of pre-rendering the whole dataset.
+#
+# instruments.json / anatomy.json are parsed once into an in-memory index; rendered
+# results are kept in an LRU cache. When a JSON file changes on disk it is re-indexed
+# and only the cached results of frames whose annotations changed are dropped.
+# Mappings, label values, colors and blending match json_to_mask_* and
+# json_to_overlay_*, so the responses are identical to the batch outputs.
+#
+# Endpoints (PNG responses):
+#   GET /mask/<task>/<image_id>
+#   GET /overlay/<task>/<image_id>
+#   GET /crop/<task>/<image_id>/<annotation_id>
+#   GET /images/<task>          -> JSON list of the image_ids that have annotations
+# with <task> one of "instrument", "auxtool", "anatomy".
+import os
+import json
+import time
+import hashlib
+import threading
+import traceback
+import cv2
+import numpy as np
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from label_mappings import (AuxTool_mapping, Instrument_mapping, anatomy_label_mapping, anatomy_mapping,
+                            auxtool_label_mapping, hex2bgr, instrument_label_mapping)
+from patch_store import annotation_boxes, expand_boxes
+from polygon_sanitizer import PolygonCache
+
+
+# --- Define the tasks: annotation file, effective mapping and mask label values ---
+# Mappings and label values come from label_mappings.py, as in json_to_mask_*.
+instrument_json = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json"  # Adjust the path as needed.
+anatomy_json = "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/anatomy.json"  # Adjust the path as needed.
+
+tasks = {
+    "instrument": {
+        "json_file": instrument_json,
+        "mapping": Instrument_mapping,
+        "labels": instrument_label_mapping,
+    },
+    "auxtool": {
+        "json_file": instrument_json,
+        "mapping": AuxTool_mapping,
+        "labels": auxtool_label_mapping,
+    },
+    "anatomy": {
+        "json_file": anatomy_json,
+        "mapping": anatomy_mapping,
+        "labels": anatomy_label_mapping,
+    },
+}
+
+# --- Service settings ---
+host = "127.0.0.1"
+port = 8765
+cache_size = 512            # Rendered results kept in memory (LRU).
+reload_check_interval = 1.0 # Seconds between mtime checks of the JSON files.
+alpha = 0.4                 # Blending factor for the overlay polygons (as json_to_overlay_*).
+crop_padding = 0.15         # Context around annotation crops, as a fraction of the box size.
+crop_min_size = 32          # Minimum crop side length in pixels.
+polygon_tolerance = 0.0     # Polygon simplification tolerance (as json_to_mask_*).
+
+# Sanitized polygons, kept in memory and keyed by segmentation (edited polygons get new entries).
+polygon_cache = PolygonCache(None, polygon_tolerance)
+
+# --- In-memory annotation index ---
+# One entry per JSON file: its mtime, generation, image infos, annotations per image and
+# a digest of each image's annotations (used to invalidate only changed frames on reload).
+indexes = {}
+index_lock = threading.Lock()
+last_reload_check = 0.0
+index_generation = 0
+
+# Cached results are (generation, png): a render only goes into the cache if its JSON was
+# not re-indexed meanwhile, and unchanged frames are re-tagged with the new generation.
+render_cache = OrderedDict()
+cache_lock = threading.Lock()
+
+def load_index(json_file):
+    """Parse a COCO JSON file into the in-memory index entry."""
+    global index_generation
+    mtime = os.path.getmtime(json_file)
+    with open(json_file, "r") as f:
+        data = json.load(f)
+    annotations = defaultdict(list)
+    for ann in data.get("annotations", []):
+        annotations[ann["image_id"]].append(ann)
+    digests = {image_id: hashlib.sha1(json.dumps(anns, sort_keys=True).encode()).hexdigest()
+               for image_id, anns in annotations.items()}
+    print(f"Indexed {json_file}: {len(data.get('images', []))} images, {len(digests)} annotated.")
+    index_generation += 1
+    return {
+        "mtime": mtime,
+        "generation": index_generation,
+        "images": {img["id"]: img for img in data.get("images", [])},
+        "annotations": annotations,
+        "digests": digests,
+    }
+
+def refresh_indexes():
+    """
+    Re-index JSON files that changed on disk and drop stale cached renders.
+
+    A file that cannot be read or parsed (e.g. caught half-saved) is logged and its
+    previous index is kept; it is retried at the next check.
+    """
+    global last_reload_check
+    now = time.time()
+    if now - last_reload_check < reload_check_interval:
+        return
+    last_reload_check = now
+    with index_lock:
+        for json_file in {task["json_file"] for task in tasks.values()}:
+            old = indexes.get(json_file)
+            try:
+                if old is not None and os.path.getmtime(json_file) == old["mtime"]:
+                    continue
+                new = load_index(json_file)
+            except (OSError, ValueError) as e:
+                if old is None:
+                    raise
+                print(f"Warning: Could not re-index {json_file} ({e}); keeping the previous index.")
+                continue
+            if old is None:
+                indexes[json_file] = new
+                continue
+            changed = {image_id for image_id in set(old["digests"]) | set(new["digests"])
+                       if old["digests"].get(image_id) != new["digests"].get(image_id)}
+            with cache_lock:
+                indexes[json_file] = new
+                for key in [k for k in render_cache if k[1] == json_file]:
+                    if key[2] in changed:
+                        del render_cache[key]
+                    else:
+                        render_cache[key] = (new["generation"], render_cache[key][1])
+            print(f"Reloaded {json_file}: {len(changed)} frames changed.")
+
+class NotFound(Exception):
+    """A requested frame, annotation or image file does not exist (HTTP 404)."""
+
+def task_annotations(task_name, image_id):
+    """Return (image info, annotations of the task's classes) for an image_id."""
+    task = tasks[task_name]
+    index = indexes[task["json_file"]]
+    img_info = index["images"].get(image_id)
+    if img_info is None:
+        raise NotFound(f"Image id {image_id} not found")
+    anns = [ann for ann in index["annotations"].get(image_id, [])
+            if ann.get("category_id") in task["mapping"]]
+    return img_info, anns
+
+def load_frame(img_info):
+    img = cv2.imread(img_info["path"])
+    if img is None:
+        raise NotFound(f"Could not load image at {img_info['path']}")
+    return img
+
+def render_mask(task_name, image_id):
+    """Render the gray-level mask exactly as json_to_mask_* does."""
+    task = tasks[task_name]
+    img_info, anns = task_annotations(task_name, image_id)
+    width, height = img_info.get("width", None), img_info.get("height", None)
+    if width is None or height is None:
+        height, width = load_frame(img_info).shape[:2]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for ann in anns:
+        label_value = task["labels"].get(task["mapping"].get(ann.get("category_id")), 0)
+        for pts in polygon_cache.polygons(ann, width, height):
+            cv2.fillPoly(mask, [pts], color=int(label_value))
+    return mask
+
+def render_overlay(task_name, image_id):
+    """Render the blended overlay exactly as json_to_overlay_* does."""
+    img_info, anns = task_annotations(task_name, image_id)
+    overlay_img = load_frame(img_info)
+    height, width = overlay_img.shape[:2]
+    for ann in anns:
+        bgr_color = hex2bgr(ann.get("color", "#FFFFFF"))
+        for pts in polygon_cache.polygons(ann, width, height):
+            temp_overlay = overlay_img.copy()
+            cv2.fillPoly(temp_overlay, [pts], bgr_color)
+            overlay_img = cv2.addWeighted(temp_overlay, alpha, overlay_img, 1 - alpha, 0)
+    return overlay_img
+
+def render_crop(task_name, image_id, annotation_id):
+    """Render the frame crop around one annotation (same windows as patch extraction)."""
+    img_info, anns = task_annotations(task_name, image_id)
+    anns = [ann for ann in anns if ann.get("id") == annotation_id]
+    if not anns:
+        raise NotFound(f"Annotation {annotation_id} not found on image {image_id}")
+    img = load_frame(img_info)
+    boxes, valid = annotation_boxes(anns)
+    if not valid[0]:
+        raise NotFound(f"Annotation {annotation_id} has no polygon")
+    x0, y0, x1, y1 = expand_boxes(boxes, img.shape[1], img.shape[0], crop_padding, crop_min_size)[0]
+    return img[y0:y1, x0:x1]
+
+renderers = {"mask": render_mask, "overlay": render_overlay, "crop": render_crop}
+
+def cached_render(kind, task_name, ids):
+    """Render (or fetch from the LRU cache) a PNG-encoded result."""
+    json_file = tasks[task_name]["json_file"]
+    key = (kind, json_file, ids[0], task_name) + tuple(ids[1:])
+    with cache_lock:
+        generation = indexes[json_file]["generation"]
+        entry = render_cache.get(key)
+        if entry is not None and entry[0] == generation:
+            render_cache.move_to_end(key)
+            return entry[1]
+    ok, png = cv2.imencode(".png", renderers[kind](task_name, *ids))
+    if not ok:
+        raise RuntimeError(f"Could not encode {kind} for image {ids[0]}")
+    png = png.tobytes()
+    with cache_lock:
+        # Skip caching if the JSON was re-indexed while rendering: the result may be stale.
+        if indexes[json_file]["generation"] == generation:
+            render_cache[key] = (generation, png)
+        while len(render_cache) > cache_size:
+            render_cache.popitem(last=False)
+    return png
+
+class RenderHandler(BaseHTTPRequestHandler):
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        try:
+            refresh_indexes()
+            if len(parts) == 2 and parts[0] == "images" and parts[1] in tasks:
+                task = tasks[parts[1]]
+                index = indexes[task["json_file"]]
+                image_ids = sorted(image_id for image_id, anns in index["annotations"].items()
+                                   if any(ann.get("category_id") in task["mapping"] for ann in anns))
+                self.send_body(200, json.dumps(image_ids).encode(), "application/json")
+                return
+            if len(parts) < 3 or parts[0] not in renderers or parts[1] not in tasks:
+                self.send_body(404, b"Unknown endpoint\n", "text/plain")
+                return
+            try:
+                ids = [int(p) for p in parts[2:]]
+            except ValueError:
+                self.send_body(400, b"Ids must be integers\n", "text/plain")
+                return
+            if len(ids) != (2 if parts[0] == "crop" else 1):
+                self.send_body(400, b"Wrong number of ids\n", "text/plain")
+                return
+            self.send_body(200, cached_render(parts[0], parts[1], ids), "image/png")
+        except NotFound as e:
+            self.send_body(404, f"{e}\n".encode(), "text/plain")
+        except Exception as e:
+            # Malformed annotations and other render failures are server errors, even a
+            # KeyError from an unmapped class: log the traceback and report the real error.
+            traceback.print_exc()
+            self.send_body(500, f"{type(e).__name__}: {e}\n".encode(), "text/plain")
+
+# --- Start the service ---
+refresh_indexes()
+server = ThreadingHTTPServer((host, port), RenderHandler)
+print(f"Serving masks, overlays and crops on http://{host}:{port}")
+server.serve_forever()
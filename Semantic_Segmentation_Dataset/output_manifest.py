@@ -0,0 +1,51 @@
+# Checksum manifest of generated masks, used by verify_outputs.py.
+#
+# json_to_mask_* record one row per mask: the digest of the annotations it was drawn
+# from, its size, its output format and a digest of its pixels. Verification can then
+# detect stale or corrupted masks without re-rendering everything.
+import os
+import csv
+import json
+import struct
+import hashlib
+
+MANIFEST_HEADER = ["mask_path", "image_id", "annotation_digest", "width", "height", "format", "pixel_digest"]
+
+def annotation_digest(ann_list):
+    """Digest of the annotations a mask is drawn from (order-sensitive, like fillPoly)."""
+    return hashlib.sha1(json.dumps(ann_list, sort_keys=True).encode()).hexdigest()
+
+def pixel_digest(array):
+    """Digest of a decoded mask's shape and pixel values."""
+    digest = hashlib.sha1(str(array.shape).encode())
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def read_manifest(path):
+    """Manifest rows keyed by mask path relative to the mask output folder."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="") as f:
+        return {row["mask_path"]: row for row in csv.DictReader(f)}
+
+def update_manifest(path, rows):
+    """Merge rows (dicts with MANIFEST_HEADER keys) into the manifest at path."""
+    manifest = read_manifest(path)
+    for row in rows:
+        manifest[row["mask_path"]] = row
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_HEADER)
+        writer.writeheader()
+        for key in sorted(manifest):
+            writer.writerow(manifest[key])
+    os.replace(tmp_path, path)
+
+def png_header(path):
+    """(width, height, bit depth, color type) from a PNG's IHDR chunk, or None if not a valid PNG."""
+    with open(path, "rb") as f:
+        head = f.read(29)
+    if len(head) < 29 or head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        return None
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", head[16:26])
+    return width, height, bit_depth, color_type
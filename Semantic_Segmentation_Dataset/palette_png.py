@@ -0,0 +1,127 @@
+# Minimal reader/writer for 8-bit palette-indexed PNG masks.
+#
+# Pixel values are class IDs; the embedded PLTE chunk maps each ID to its annotation
+# color, so the same file is a training label and a readable preview in any image
+# viewer. OpenCV cannot write palette PNGs and converts them to BGR on read, so the
+# chunks are handled here directly with zlib (PIL's Image.open(path) in mode "P"
+# reads them as well).
+import zlib
+import struct
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def hex2rgb(hex_color):
+    """Convert hex color (e.g. '#3fe50f') to an RGB tuple (white if malformed)."""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) != 6:
+        return (255, 255, 255)
+    return (int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16))
+
+def _chunk(tag, data):
+    return (struct.pack(">I", len(data)) + tag + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+def write_palette_png(path, index_array, palette, text=None, compress_level=6):
+    """
+    Write a 2-D uint8 array of class IDs as a palette-indexed PNG.
+
+    'palette' is a list of RGB tuples indexed by class ID; 'text' is an optional
+    dict stored as tEXt chunks (e.g. the class names).
+    """
+    index_array = np.ascontiguousarray(index_array, dtype=np.uint8)
+    height, width = index_array.shape
+    # Every scanline starts with filter type 0 (None).
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = index_array
+
+    png = [PNG_SIGNATURE,
+           _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+           _chunk(b"PLTE", bytes(c for rgb in palette for c in rgb))]
+    for key, value in (text or {}).items():
+        png.append(_chunk(b"tEXt", key.encode("latin-1") + b"\0" + str(value).encode("latin-1")))
+    png.append(_chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level)))
+    png.append(_chunk(b"IEND", b""))
+    with open(path, "wb") as f:
+        f.write(b"".join(png))
+
+def _unfilter_wavefront(rows, height, width):
+    """
+    Undo any mix of PNG filters, vectorized over anti-diagonals.
+
+    Average and Paeth predict from the left, upper and upper-left pixels, so a row
+    cannot be decoded in one step; all pixels with the same y + x only depend on the
+    previous diagonals, which takes height + width - 1 numpy steps per image.
+    """
+    filters = rows[:, 0].astype(np.int64)
+    line = rows[:, 1:].astype(np.int64)
+    # Padded by one zero row on top and one zero column on the left (the PNG's
+    # "outside the image" neighbours).
+    out = np.zeros((height + 1, width + 1), dtype=np.int64)
+    for d in range(height + width - 1):
+        y = np.arange(max(0, d - width + 1), min(d, height - 1) + 1)
+        x = d - y
+        left, up, up_left = out[y + 1, x], out[y, x + 1], out[y, x]
+        p = left + up - up_left
+        pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - up_left)
+        paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+        f = filters[y]
+        pred = np.select([f == 1, f == 2, f == 3, f == 4], [left, up, (left + up) // 2, paeth], 0)
+        out[y + 1, x + 1] = (line[y, x] + pred) & 0xFF
+    return out[1:, 1:].astype(np.uint8)
+
+def _unfilter(raw, height, width):
+    """Undo PNG scanline filters for 8-bit single-channel data (1 byte per pixel)."""
+    rows = raw.reshape(height, width + 1)
+    if np.isin(rows[:, 0], (3, 4)).any():
+        # Average/Paeth rows (e.g. files written by PIL or OpenCV).
+        return _unfilter_wavefront(rows, height, width)
+    # None/Sub/Up rows only (write_palette_png uses None): one vectorized step per row.
+    out = np.zeros((height, width), dtype=np.uint8)
+    prev = np.zeros(width, dtype=np.uint8)
+    for y in range(height):
+        filter_type, line = rows[y, 0], rows[y, 1:]
+        if filter_type == 0:
+            cur = line.copy()
+        elif filter_type == 1:
+            cur = np.cumsum(line, dtype=np.uint8)
+        else:
+            cur = line + prev
+        out[y] = cur
+        prev = cur
+    return out
+
+def read_palette_png(path):
+    """
+    Read an 8-bit palette-indexed (or gray) PNG without any color conversion.
+
+    Returns (index_array, palette, text) where palette is a list of RGB tuples
+    (empty for gray PNGs) and text is a dict of the tEXt chunks.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError(f"{path} is not a PNG file")
+
+    pos = len(PNG_SIGNATURE)
+    idat, palette, text = [], [], {}
+    while pos < len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if tag == b"IHDR":
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+            if bit_depth != 8 or color_type not in (0, 3) or interlace:
+                raise ValueError(f"{path}: only non-interlaced 8-bit palette or gray PNGs are supported")
+        elif tag == b"PLTE":
+            palette = [tuple(body[k:k + 3]) for k in range(0, len(body), 3)]
+        elif tag == b"tEXt":
+            key, _, value = body.partition(b"\0")
+            text[key.decode("latin-1")] = value.decode("latin-1")
+        elif tag == b"IDAT":
+            idat.append(body)
+        elif tag == b"IEND":
+            break
+
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8)
+    return _unfilter(raw, height, width), palette, text
@@ -0,0 +1,123 @@
+# Helpers for extracting annotation-centred patches during the mask pass.
+#
+# Bounding boxes (and polygon areas) are computed for all annotations at once: the polygon
+# vertices are concatenated into one array and reduced per annotation with
+# np.minimum/np.maximum.reduceat over CSR-style offsets. Crops of the frame and of
+# the mask are appended as raw uint8 arrays to a single packed file
+# (<store>/patches.bin), indexed by <store>/patches.csv.
+import os
+import csv
+import numpy as np
+
+PATCH_INDEX_HEADER = ["patch_id", "image_id", "annotation_id", "class_name",
+                      "x0", "y0", "x1", "y1", "frame_offset", "mask_offset"]
+
+def polygon_arrays(ann_list):
+    """
+    Concatenate the polygon vertices of every annotation.
+
+    Returns an (N, 2) float array of all vertices and the per-annotation start
+    offsets and vertex counts into it (CSR layout).
+    """
+    chunks, counts = [], []
+    for ann in ann_list:
+        pts = [np.asarray(seg, dtype=np.float64).reshape(-1, 2)
+               for seg in ann.get("segmentation", []) if len(seg) >= 2]
+        pts = np.concatenate(pts) if pts else np.zeros((0, 2))
+        chunks.append(pts)
+        counts.append(len(pts))
+    counts = np.array(counts, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    vertices = np.concatenate(chunks) if chunks else np.zeros((0, 2))
+    return vertices, offsets, counts
+
+def annotation_boxes(ann_list):
+    """
+    Return (boxes, valid): one [x_min, y_min, x_max, y_max] row per annotation and
+    a boolean mask of the annotations that have at least one vertex.
+    """
+    vertices, offsets, counts = polygon_arrays(ann_list)
+    valid = counts > 0
+    boxes = np.full((len(ann_list), 4), np.nan)
+    if valid.any():
+        starts = offsets[valid]
+        boxes[valid, 0] = np.minimum.reduceat(vertices[:, 0], starts)
+        boxes[valid, 1] = np.minimum.reduceat(vertices[:, 1], starts)
+        boxes[valid, 2] = np.maximum.reduceat(vertices[:, 0], starts)
+        boxes[valid, 3] = np.maximum.reduceat(vertices[:, 1], starts)
+    return boxes, valid
+
+def annotation_areas(ann_list):
+    """
+    Polygon area of every annotation (shoelace formula, summed over its polygons).
+
+    All polygons are concatenated once; each vertex's cross term with its successor
+    (wrapping within its polygon) is summed per polygon with np.add.reduceat and the
+    polygon areas are summed per annotation with np.bincount.
+    """
+    chunks, counts, owners = [], [], []
+    for k, ann in enumerate(ann_list):
+        for seg in ann.get("segmentation", []):
+            if len(seg) >= 6:
+                chunks.append(np.asarray(seg, dtype=np.float64).reshape(-1, 2))
+                counts.append(len(seg) // 2)
+                owners.append(k)
+    if not chunks:
+        return np.zeros(len(ann_list))
+    vertices = np.concatenate(chunks)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    successor = np.arange(1, len(vertices) + 1)
+    successor[starts + np.array(counts) - 1] = starts
+    x, y = vertices[:, 0], vertices[:, 1]
+    cross = x * y[successor] - x[successor] * y
+    polygon_areas = 0.5 * np.abs(np.add.reduceat(cross, starts))
+    return np.bincount(owners, weights=polygon_areas, minlength=len(ann_list))
+
+def expand_boxes(boxes, width, height, padding=0.0, min_size=0, aspect_ratio=None):
+    """
+    Turn tight boxes into integer crop windows [x0, y0, x1, y1) inside the frame.
+
+    Each box is padded by 'padding' times its size, grown to at least 'min_size'
+    pixels per side and, if 'aspect_ratio' (width / height) is given, grown along
+    its shorter side to match it. Windows are shifted back inside the frame where
+    possible and clipped otherwise.
+    """
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    w = (boxes[:, 2] - boxes[:, 0]) * (1 + 2 * padding)
+    h = (boxes[:, 3] - boxes[:, 1]) * (1 + 2 * padding)
+    w = np.maximum(w, min_size)
+    h = np.maximum(h, min_size)
+    if aspect_ratio:
+        w = np.maximum(w, h * aspect_ratio)
+        h = np.maximum(h, w / aspect_ratio)
+    w = np.minimum(np.ceil(w), width)
+    h = np.minimum(np.ceil(h), height)
+
+    x0 = np.clip(np.round(cx - w / 2), 0, width - w)
+    y0 = np.clip(np.round(cy - h / 2), 0, height - h)
+    windows = np.stack([x0, y0, x0 + w, y0 + h], axis=1)
+    return windows.astype(np.int64)
+
+def append_patch(bin_f, array):
+    """Append a uint8 array to the packed store and return its byte offset."""
+    offset = bin_f.tell()
+    bin_f.write(np.ascontiguousarray(array, dtype=np.uint8).tobytes())
+    return offset
+
+def read_patches(store_dir):
+    """
+    Yield (row, frame_crop, mask_crop) for every patch in a store.
+
+    The packed file is memory-mapped, so iterating never loads the whole store.
+    """
+    data = np.memmap(os.path.join(store_dir, "patches.bin"), dtype=np.uint8, mode="r")
+    with open(os.path.join(store_dir, "patches.csv"), newline="") as f:
+        for row in csv.DictReader(f):
+            h = int(row["y1"]) - int(row["y0"])
+            w = int(row["x1"]) - int(row["x0"])
+            frame_offset = int(row["frame_offset"])
+            mask_offset = int(row["mask_offset"])
+            frame_crop = data[frame_offset:frame_offset + h * w * 3].reshape(h, w, 3)
+            mask_crop = data[mask_offset:mask_offset + h * w].reshape(h, w)
+            yield row, frame_crop, mask_crop
@@ -0,0 +1,194 @@
+# Polygon sanitization before rasterization.
+#
+# Segmentation polygons are truncated to integer pixel coordinates as before; vertices
+# with non-finite coordinates are removed and polygons left with fewer than three
+# vertices are dropped instead of being drawn as lines or dots. Everything else is
+# left to cv2.fillPoly, which clips at the frame edge, so at tolerance 0 the masks are
+# identical to rasterizing the raw vertices.
+#
+# With a tolerance > 0 the geometry is changed as well: polygons are clipped to the
+# frame (Sutherland-Hodgman, vectorized over the edges; intersections are rounded to
+# pixels), stripped of repeated and collinear vertices and simplified with
+# cv2.approxPolyDP. Results are cached per annotation in an .npz file, keyed by the
+# segmentation, the frame size and the tolerance.
+import os
+import csv
+import json
+import hashlib
+import cv2
+import numpy as np
+
+# Bumped whenever sanitize_polygon() output changes, so older cache files are not reused.
+CACHE_VERSION = 2
+
+SANITIZE_REPORT_HEADER = ["annotation_id", "polygon", "vertices_in", "vertices_out", "iou", "status"]
+
+def _clip_half_plane(pts, axis, bound, keep_below):
+    """Clip a closed polygon against the half plane pts[:, axis] <= bound (or >= bound)."""
+    coord = pts[:, axis]
+    inside = coord <= bound if keep_below else coord >= bound
+    nxt = np.roll(pts, -1, axis=0)
+    crossing = inside != np.roll(inside, -1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(crossing, (bound - coord) / (nxt[:, axis] - coord), 0.0)
+    intersection = pts + t[:, None] * (nxt - pts)
+    intersection[crossing, axis] = bound
+    # Each edge emits its start vertex if inside, then its intersection if it crosses.
+    out = np.stack([pts, intersection], axis=1).reshape(-1, 2)
+    return out[np.stack([inside, crossing], axis=1).reshape(-1)]
+
+def clip_polygon(pts, width, height):
+    """Clip an (N, 2) float polygon to the frame [0, width - 1] x [0, height - 1]."""
+    for axis, bound, keep_below in ((0, 0, False), (0, width - 1, True),
+                                    (1, 0, False), (1, height - 1, True)):
+        if not len(pts):
+            break
+        pts = _clip_half_plane(pts, axis, bound, keep_below)
+    return pts
+
+def remove_redundant_vertices(pts):
+    """Drop repeated vertices and vertices on a straight run between their neighbours."""
+    if len(pts):
+        keep = np.any(pts != np.roll(pts, 1, axis=0), axis=1)
+        pts = pts[keep] if keep.any() else pts[:1]
+    if len(pts) < 3:
+        return pts
+    v = pts.astype(np.int64)
+    incoming = v - np.roll(v, 1, axis=0)
+    outgoing = np.roll(v, -1, axis=0) - v
+    cross = incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0]
+    dot = (incoming * outgoing).sum(axis=1)
+    # Collinear vertices that reverse direction (spikes) are kept; they change the raster.
+    return pts[(cross != 0) | (dot < 0)]
+
+def sanitize_polygon(seg, width, height, tolerance=0.0):
+    """
+    Return (pts, clipped): the int32 (K, 2) vertices to pass to cv2.fillPoly, or None
+    if fewer than three remain, and whether the polygon was clipped to the frame
+    (only with tolerance > 0).
+    """
+    pts = np.asarray(seg, dtype=np.float64).reshape(-1, 2)
+    # Truncate, as the raw vertices always were, so polygons raster identically.
+    pts = pts[np.isfinite(pts).all(axis=1)].astype(np.int32)
+    clipped = False
+    if tolerance > 0 and len(pts):
+        clipped = bool((pts.min(axis=0) < 0).any() or (pts.max(axis=0) > [width - 1, height - 1]).any())
+        if clipped:
+            pts = np.round(clip_polygon(pts.astype(np.float64), width, height)).astype(np.int32)
+        pts = remove_redundant_vertices(pts)
+        if len(pts) >= 3:
+            pts = cv2.approxPolyDP(pts.reshape(-1, 1, 2), tolerance, True).reshape(-1, 2)
+    return (pts if len(pts) >= 3 else None), clipped
+
+def raster_iou(seg, pts, width, height):
+    """IoU between the in-frame rasters of a raw segmentation and its sanitized vertices."""
+    raw = np.asarray(seg, dtype=np.float64).reshape(-1, 2)
+    raw = raw[np.isfinite(raw).all(axis=1)].astype(np.int32)
+    if not len(raw):
+        return 1.0 if pts is None else 0.0
+    # Rasterize both inside the raw polygon's bounding box only.
+    x0, y0 = np.maximum(raw.min(axis=0), 0)
+    x1, y1 = np.minimum(raw.max(axis=0), [width - 1, height - 1])
+    if x1 < x0 or y1 < y0:
+        return 1.0 if pts is None else 0.0
+    offset = np.array([x0, y0], dtype=np.int32)
+    before = np.zeros((y1 - y0 + 1, x1 - x0 + 1), dtype=np.uint8)
+    after = np.zeros_like(before)
+    cv2.fillPoly(before, [raw - offset], color=1)
+    if pts is not None:
+        cv2.fillPoly(after, [pts - offset], color=1)
+    union = np.count_nonzero(before | after)
+    return float(np.count_nonzero(before & after)) / union if union else 1.0
+
+class PolygonCache:
+    """
+    Sanitized polygons per annotation, persisted in an .npz file.
+
+    polygons(ann, width, height) returns the list of int32 vertex arrays to rasterize.
+    With report=True the raster IoU of every sanitized polygon against its raw
+    vertices is computed (once; it is cached too) and write_report() lists it for the
+    annotations used in this run.
+    """
+
+    def __init__(self, cache_file=None, tolerance=0.0, report=False):
+        self.cache_file = cache_file
+        self.tolerance = tolerance
+        self.report = report
+        self.entries = {}  # key -> (polygons, stats rows [vertices_in, vertices_out, clipped, iou])
+        self.used = {}     # key -> annotation id, for the report
+        self.dirty = False
+        if cache_file and os.path.exists(cache_file):
+            self._load()
+
+    def _key(self, ann, width, height):
+        payload = json.dumps([ann.get("segmentation", []), width, height, self.tolerance, CACHE_VERSION])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def polygons(self, ann, width, height):
+        key = self._key(ann, width, height)
+        entry = self.entries.get(key)
+        if entry is None or (self.report and np.isnan(entry[1][:, 3]).any()):
+            entry = self._sanitize(ann, width, height)
+            self.entries[key] = entry
+            self.dirty = True
+        self.used[key] = ann.get("id")
+        return [pts for pts in entry[0] if pts is not None]
+
+    def _sanitize(self, ann, width, height):
+        polygons, stats = [], []
+        for seg in ann.get("segmentation", []):
+            pts, clipped = sanitize_polygon(seg, width, height, self.tolerance)
+            iou = raster_iou(seg, pts, width, height) if self.report else np.nan
+            polygons.append(pts)
+            stats.append([len(seg) // 2, 0 if pts is None else len(pts), clipped, iou])
+        return polygons, np.array(stats, dtype=np.float64).reshape(-1, 4)
+
+    def _load(self):
+        with np.load(self.cache_file) as npz:
+            keys, poly_start = npz["keys"], npz["poly_start"]
+            stats, vert_start, vertices = npz["stats"], npz["vert_start"], npz["vertices"]
+        for k, key in enumerate(keys):
+            polygons = []
+            for p in range(poly_start[k], poly_start[k + 1]):
+                pts = vertices[vert_start[p]:vert_start[p + 1]]
+                polygons.append(pts if len(pts) else None)
+            self.entries[str(key)] = (polygons, stats[poly_start[k]:poly_start[k + 1]])
+
+    def save(self):
+        """Write the cache (atomically) if anything was added."""
+        if not self.cache_file or not self.dirty:
+            return
+        keys = list(self.entries)
+        polygons = [pts for key in keys for pts in self.entries[key][0]]
+        counts = [0 if pts is None else len(pts) for pts in polygons]
+        poly_start = np.cumsum([0] + [len(self.entries[key][0]) for key in keys])
+        stats = [self.entries[key][1] for key in keys]
+        tmp_path = self.cache_file + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f,
+                     keys=np.array(keys),
+                     poly_start=poly_start.astype(np.int64),
+                     stats=np.concatenate(stats) if stats else np.zeros((0, 4)),
+                     vert_start=np.cumsum([0] + counts).astype(np.int64),
+                     vertices=np.concatenate([pts for pts in polygons if pts is not None] or
+                                             [np.zeros((0, 2), dtype=np.int32)]).astype(np.int32))
+        os.replace(tmp_path, self.cache_file)
+        self.dirty = False
+
+    def write_report(self, path):
+        """Per-polygon vertex reduction and IoU loss of the annotations used in this run."""
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(SANITIZE_REPORT_HEADER)
+            for key, annotation_id in self.used.items():
+                for p, (n_in, n_out, clipped, iou) in enumerate(self.entries[key][1]):
+                    if n_out == 0:
+                        status = "dropped"
+                    elif clipped:
+                        status = "clipped"
+                    elif n_out < n_in:
+                        status = "reduced"
+                    else:
+                        status = "unchanged"
+                    writer.writerow([annotation_id, p, int(n_in), int(n_out),
+                                     "" if np.isnan(iou) else round(float(iou), 4), status])
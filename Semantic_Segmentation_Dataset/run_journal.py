@@ -0,0 +1,108 @@
+# Crash-safe outputs and resumable runs for json_to_mask_* and json_to_overlay_*.
+#
+# atomic_write() writes an output under a temporary name and renames it into place, so
+# a run killed mid-write never leaves a truncated PNG behind. RunJournal appends the
+# image_ids of completed frames (with the per-frame record a script needs for its
+# end-of-run indexes) to a JSON-lines file, one line per batch. A resumed run skips
+# the journaled frames except those of the last batch, which are processed again, and
+# sweep_temp_files() removes the temporary files a killed run left behind.
+import os
+import re
+import json
+import time
+import threading
+
+def atomic_write(write_fn, path, *args):
+    """Call write_fn(tmp_path, *args) and rename the result to path; fails if write_fn returns False."""
+    root, ext = os.path.splitext(path)
+    # Keep the extension last: cv2.imwrite picks the encoder from it.
+    tmp_path = f"{root}.tmp{os.getpid()}_{threading.get_ident()}{ext}"
+    try:
+        if write_fn(tmp_path, *args) is False:
+            raise IOError(f"Could not write {path}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Temporary names made by atomic_write(): <base>.tmp<pid>_<thread><ext>.
+TEMP_FILE_PATTERN = re.compile(r"\.tmp\d+_\d+(\.[^.]*)?$")
+
+def is_temp_file(file_name):
+    return TEMP_FILE_PATTERN.search(file_name) is not None
+
+def sweep_temp_files(roots):
+    """Remove atomic_write() temporary files under the given output trees; returns how many."""
+    removed = 0
+    for root in roots:
+        for dirpath, _, files in os.walk(root):
+            for file in files:
+                if is_temp_file(file):
+                    os.remove(os.path.join(dirpath, file))
+                    removed += 1
+    return removed
+
+class RunJournal:
+    """
+    Batched journal of completed frames.
+
+    mark(image_id, record) buffers a completed frame; every 'batch_size' frames or
+    'max_interval' seconds the buffer is appended as one line and fsynced.
+    'before_flush' runs first (e.g. BackgroundWriter.drain) so that only frames whose
+    outputs are on disk get journaled. With resume=True, 'records' holds the frames of
+    earlier runs that can be skipped; otherwise the journal starts empty.
+    """
+
+    def __init__(self, path, resume=False, batch_size=50, max_interval=5.0, before_flush=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_interval = max_interval
+        self.before_flush = before_flush
+        self.records = {}
+        self.pending = []
+
+        batches = self._read() if resume else []
+        # Re-check the last batch: its frames are dropped from the journal and redone.
+        kept = batches[:-1]
+        for batch in kept:
+            for image_id, record in batch:
+                self.records[image_id] = record
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for batch in kept:
+                f.write(json.dumps(batch) + "\n")
+        self.f = open(path, "a")
+        self.last_flush = time.monotonic()
+
+    def _read(self):
+        batches = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        batches.append(json.loads(line))
+                    except ValueError:
+                        break  # Line cut short by the crash.
+        return batches
+
+    def is_done(self, image_id):
+        return image_id in self.records
+
+    def mark(self, image_id, record=None):
+        self.pending.append([image_id, record])
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.max_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            if self.before_flush:
+                self.before_flush()
+            self.f.write(json.dumps(self.pending) + "\n")
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.f.close()
@@ -0,0 +1,235 @@
+# This script verifies generated masks (and overlays) against the current annotation JSON
+# without regenerating them.
+#
+#  1. Expected outputs are derived from the JSON: missing files, stale files left
+#     over from deleted annotations and temporary files of interrupted runs are listed.
+#  2. Every mask is checked against the checksum manifest written by json_to_mask_*:
+#     unrecorded masks, masks drawn from annotations that have changed since, and
+#     masks whose pixels no longer match the recorded digest.
+#  3. All masks are scanned in parallel: size and format from the PNG header, and
+#     the set of values present (must be 0 or a value of mask_label_mapping).
+#  4. A random sample plus every mismatching frame is re-rendered and compared
+#     pixel-exactly with the file on disk.
+import os
+import csv
+import sys
+import json
+import random
+import cv2
+import numpy as np
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from label_mappings import label_sets
+from output_manifest import annotation_digest, pixel_digest, read_manifest, png_header
+from palette_png import read_palette_png
+from polygon_sanitizer import PolygonCache
+from run_journal import is_temp_file
+
+# --- Task definitions (mappings and label values from label_mappings.py, as json_to_mask_*) ---
+verify_tasks = {
+    "instrument": {
+        "json_file": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json",
+        "input_base": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg",
+        "mask_output_base": "instrument_mask",
+        "overlay_output_base": "instrument_overlays",
+        "label_set": "instrument",
+    },
+    "auxtool": {
+        "json_file": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/instruments.json",
+        "input_base": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg",
+        "mask_output_base": "auxtool_mask",
+        "overlay_output_base": "auxtool_overlays",
+        "label_set": "auxtool",
+    },
+    "anatomy": {
+        "json_file": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/anatomy.json",
+        "input_base": "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/ganseg",
+        "mask_output_base": "anatomy_mask",
+        "overlay_output_base": "anatomy_overlays",
+        "label_set": "anatomy",
+    },
+}  # Adjust the paths as needed.
+
+# --- Verification settings ---
+task_name = "instrument"
+rerender_samples = 50   # Randomly chosen frames re-rendered in addition to all mismatches.
+num_workers = 8
+polygon_tolerance = 0.0  # Must match the mask scripts' polygon_tolerance.
+report_file = f"verify_{task_name}_report.csv"
+
+task = verify_tasks[task_name]
+mapping, labels = label_sets[task["label_set"]]
+mask_output_base = task["mask_output_base"]
+class_index = {name: k + 1 for k, name in enumerate(labels)}
+
+# --- Expected outputs from the current JSON ---
+with open(task["json_file"], "r") as f:
+    data = json.load(f)
+images_info = {img["id"]: img for img in data.get("images", [])}
+annotations_grouped = defaultdict(list)
+for ann in data.get("annotations", []):
+    if ann.get("category_id") in mapping:
+        annotations_grouped[ann["image_id"]].append(ann)
+
+expected_masks = {}
+expected_overlays = set()
+input_base = task["input_base"]
+for image_id in annotations_grouped:
+    img_info = images_info.get(image_id)
+    if not img_info:
+        continue
+    img_path = img_info["path"]
+    file_name = img_info.get("file_name", os.path.basename(img_path))
+    if img_path.startswith(input_base + os.sep):
+        rel_path = img_path[len(input_base + os.sep):]
+    else:
+        rel_path = img_path
+    rel_dir = os.path.dirname(rel_path)
+    base, ext = os.path.splitext(file_name)
+    expected_masks[os.path.join(rel_dir, f"{base}_mask.png")] = image_id
+    expected_overlays.add(os.path.join(rel_dir, f"{base}_annotated{ext}"))
+
+def files_on_disk(root, suffix):
+    found = set()
+    for dirpath, _, files in os.walk(root):
+        for file in files:
+            if file.endswith(suffix):
+                found.add(os.path.relpath(os.path.join(dirpath, file), root))
+    return found
+
+issues = []  # (output, path, issue, detail)
+
+# --- 1. Missing and stale files ---
+present_masks = files_on_disk(mask_output_base, "_mask.png")
+for path in sorted(set(expected_masks) - present_masks):
+    issues.append(("mask", path, "missing", ""))
+for path in sorted(present_masks - set(expected_masks)):
+    issues.append(("mask", path, "stale", "no annotations in the current JSON"))
+
+if os.path.isdir(task["overlay_output_base"]):
+    present_overlays = {p for p in files_on_disk(task["overlay_output_base"], "")
+                        if os.path.splitext(p)[0].endswith("_annotated")}
+    for path in sorted(expected_overlays - present_overlays):
+        issues.append(("overlay", path, "missing", ""))
+    for path in sorted(present_overlays - expected_overlays):
+        issues.append(("overlay", path, "stale", "no annotations in the current JSON"))
+
+for output, root in [("mask", mask_output_base), ("overlay", task["overlay_output_base"])]:
+    for dirpath, _, files in os.walk(root):
+        for file in sorted(files):
+            if is_temp_file(file):
+                path = os.path.relpath(os.path.join(dirpath, file), root)
+                issues.append((output, path, "stale", "temporary file of an interrupted run"))
+
+# --- 2./3. Manifest, header and value scan (parallel) ---
+manifest = read_manifest(os.path.join(mask_output_base, "manifest.csv"))
+allowed_gray = np.zeros(256, dtype=bool)
+allowed_gray[[0] + list(labels.values())] = True
+allowed_index = np.zeros(256, dtype=bool)
+allowed_index[:len(labels) + 1] = True
+
+def load_mask(path, color_type):
+    if color_type == 3:
+        return read_palette_png(path)[0]
+    return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+def scan_mask(rel_path):
+    """Return (issues, needs re-render) for one mask present on disk."""
+    found = []
+    image_id = expected_masks[rel_path]
+    path = os.path.join(mask_output_base, rel_path)
+    header = png_header(path)
+    if header is None:
+        return [("mask", rel_path, "corrupt", "not a readable PNG")], False
+    width, height, bit_depth, color_type = header
+
+    img_info = images_info[image_id]
+    if img_info.get("width") and img_info.get("height") and (width, height) != (img_info["width"], img_info["height"]):
+        found.append(("mask", rel_path, "size", f"{width}x{height}, JSON says {img_info['width']}x{img_info['height']}"))
+    if bit_depth != 8 or color_type not in (0, 3):
+        found.append(("mask", rel_path, "format", f"bit depth {bit_depth}, color type {color_type}"))
+        return found, True
+
+    mask = load_mask(path, color_type)
+    if mask is None:
+        return found + [("mask", rel_path, "corrupt", "could not decode")], True
+    present_values = np.flatnonzero(np.bincount(mask.ravel(), minlength=256))
+    allowed = allowed_index if color_type == 3 else allowed_gray
+    bad_values = [int(v) for v in present_values if not allowed[v]]
+    if bad_values:
+        found.append(("mask", rel_path, "values", f"unexpected values {bad_values}"))
+
+    record = manifest.get(rel_path)
+    if record is None:
+        found.append(("mask", rel_path, "unrecorded", "not in manifest.csv"))
+    else:
+        if record["annotation_digest"] != annotation_digest(annotations_grouped[image_id]):
+            found.append(("mask", rel_path, "outdated", "annotations changed since generation"))
+        if record["pixel_digest"] != pixel_digest(mask):
+            found.append(("mask", rel_path, "modified", "pixels differ from manifest digest"))
+    return found, bool(found)
+
+to_scan = sorted(present_masks & set(expected_masks))
+with ThreadPoolExecutor(max_workers=num_workers) as pool:
+    results = list(pool.map(scan_mask, to_scan))
+suspicious = []
+for rel_path, (found, needs_rerender) in zip(to_scan, results):
+    issues.extend(found)
+    if needs_rerender:
+        suspicious.append(rel_path)
+
+# --- 4. Pixel-exact re-render of a sample plus all mismatches ---
+# Polygons are sanitized afresh (no cache file) so the check does not trust earlier results.
+polygon_cache = PolygonCache(None, polygon_tolerance)
+
+def render_mask(image_id, palette_mode):
+    """Render a mask exactly as json_to_mask_* does."""
+    img_info = images_info[image_id]
+    width, height = img_info.get("width", None), img_info.get("height", None)
+    if width is None or height is None:
+        img = cv2.imread(img_info["path"])
+        if img is None:
+            return None
+        height, width = img.shape[:2]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for ann in annotations_grouped[image_id]:
+        effective_name = mapping.get(ann.get("category_id"))
+        label_value = class_index.get(effective_name, 0) if palette_mode else labels.get(effective_name, 0)
+        for pts in polygon_cache.polygons(ann, width, height):
+            cv2.fillPoly(mask, [pts], color=int(label_value))
+    return mask
+
+def rerender_check(rel_path):
+    path = os.path.join(mask_output_base, rel_path)
+    header = png_header(path)
+    color_type = header[3] if header else 0
+    on_disk = load_mask(path, color_type)
+    rendered = render_mask(expected_masks[rel_path], color_type == 3)
+    if rendered is None or on_disk is None:
+        return ("mask", rel_path, "rerender", "could not load frame or mask")
+    if on_disk.shape != rendered.shape:
+        return ("mask", rel_path, "rerender", f"shape {on_disk.shape} != rendered {rendered.shape}")
+    differing = int(np.count_nonzero(on_disk != rendered))
+    if differing:
+        return ("mask", rel_path, "rerender", f"{differing} pixels differ from a fresh render")
+    return None
+
+sampled = random.sample(to_scan, min(rerender_samples, len(to_scan)))
+to_rerender = sorted(set(sampled) | set(suspicious))
+with ThreadPoolExecutor(max_workers=num_workers) as pool:
+    issues.extend(r for r in pool.map(rerender_check, to_rerender) if r is not None)
+
+# --- Report ---
+with open(report_file, "w", newline="") as f:
+    writer = csv.writer(f)
+    writer.writerow(["output", "path", "issue", "detail"])
+    writer.writerows(issues)
+
+counts = defaultdict(int)
+for output, _, issue, _ in issues:
+    counts[f"{output} {issue}"] += 1
+print(f"Checked {len(to_scan)} masks ({len(expected_masks)} expected), re-rendered {len(to_rerender)}.")
+for key, n in sorted(counts.items()):
+    print(f"  {key}: {n}")
+print(f"{'No issues found' if not issues else f'{len(issues)} issues'}; report saved to {report_file}")
+sys.exit(1 if issues else 0)
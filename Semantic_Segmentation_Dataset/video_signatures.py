@@ -0,0 +1,191 @@
+# Compact per-video appearance signatures for domain-shift analysis and fold planning.
+#
+# Every frame of a video (GANSEG_xx/<video> directory) is decoded once at reduced
+# resolution and reduced to per-channel HSV histograms plus a low-resolution image;
+# frames are processed on a thread pool and summed into one signature per video.
+# Hue/saturation/value histograms capture color, brightness and smoke (low saturation,
+# high value); the mean image captures the typical scene layout. Signatures are cached
+# per video, so re-running only decodes videos whose frames changed.
+#
+# similarity_matrix() compares all videos at once with matrix products, and
+# assign_folds() uses it to keep similar videos in one fold or spread them over folds
+# (see TrainIDs_generator_*).
+import os
+import csv
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from fold_statistics import file_list_digest
+
+HSV_BINS = 32
+MEAN_IMAGE_SIZE = (32, 18)   # (width, height) of the low-resolution mean image.
+HSV_RANGES = (180, 256, 256) # OpenCV 8-bit hue is 0..179.
+
+def frame_signature(path):
+    """(3, HSV_BINS) HSV histogram and float64 low-resolution BGR image of a frame (None if unreadable)."""
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+    if img is None:
+        return None
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    hist = np.stack([np.bincount((hsv[..., c].ravel().astype(np.int64) * HSV_BINS) // HSV_RANGES[c],
+                                 minlength=HSV_BINS) for c in range(3)])
+    small = cv2.resize(img, MEAN_IMAGE_SIZE, interpolation=cv2.INTER_AREA).astype(np.float64)
+    return hist, small
+
+def empty_signature():
+    return {"frames": 0,
+            "hist": np.zeros((3, HSV_BINS), dtype=np.int64),
+            "image_sum": np.zeros((MEAN_IMAGE_SIZE[1], MEAN_IMAGE_SIZE[0], 3), dtype=np.float64)}
+
+def video_signature(image_paths, cache_file=None, workers=8):
+    """Signature of one video's frames, reusing cache_file if it is still valid."""
+    file_digest = file_list_digest(image_paths)
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file) as npz:
+            if str(npz["file_digest"]) == file_digest:
+                return {"frames": int(npz["frames"]), "hist": npz["hist"], "image_sum": npz["image_sum"]}
+
+    signature = empty_signature()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, result in zip(image_paths, pool.map(frame_signature, image_paths)):
+            if result is None:
+                print(f"Warning: Could not load image at {path}")
+                continue
+            signature["frames"] += 1
+            signature["hist"] += result[0]
+            signature["image_sum"] += result[1]
+
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+        np.savez(cache_file, file_digest=file_digest, **signature)
+    return signature
+
+def save_signatures(path, names, signatures):
+    np.savez(path,
+             names=np.array(names),
+             frames=np.array([s["frames"] for s in signatures], dtype=np.int64),
+             hist=np.stack([s["hist"] for s in signatures]),
+             image_sum=np.stack([s["image_sum"] for s in signatures]))
+
+def load_signatures(path):
+    """Return (names, signatures) saved by save_signatures()."""
+    with np.load(path) as npz:
+        names = [str(n) for n in npz["names"]]
+        signatures = [{"frames": int(f), "hist": h, "image_sum": s}
+                      for f, h, s in zip(npz["frames"], npz["hist"], npz["image_sum"])]
+    return names, signatures
+
+def similarity_matrix(signatures, image_weight=0.5):
+    """
+    (V, V) appearance similarity in [0, 1] between all videos.
+
+    Histogram similarity is the Bhattacharyya coefficient per HSV channel (averaged),
+    mean-image similarity is 1 - RMSE / 255; both are computed for all pairs with
+    matrix products and blended with 'image_weight'.
+    """
+    hist = np.stack([s["hist"] for s in signatures]).astype(np.float64)          # (V, 3, B)
+    frames = np.maximum([s["frames"] for s in signatures], 1).astype(np.float64)
+    root = np.sqrt(hist / np.maximum(hist.sum(axis=2, keepdims=True), 1))
+    hist_sim = np.einsum("icb,jcb->ij", root, root) / 3
+
+    means = np.stack([s["image_sum"] for s in signatures]).reshape(len(signatures), -1) / frames[:, None]
+    sq = (means ** 2).sum(axis=1)
+    mse = np.maximum(sq[:, None] + sq[None, :] - 2 * means @ means.T, 0) / means.shape[1]
+    image_sim = 1 - np.sqrt(mse) / 255
+
+    return np.clip((1 - image_weight) * hist_sim + image_weight * image_sim, 0, 1)
+
+def nearest_videos(similarity, k=3):
+    """Indices of each video's k most similar other videos, most similar first."""
+    sim = similarity.copy()
+    np.fill_diagonal(sim, -np.inf)
+    return np.argsort(-sim, axis=1)[:, :k]
+
+def assign_folds(videos, names, similarity, num_folds=4, mode="same_fold", rng=None):
+    """
+    Split 'videos' (keys into 'names') into num_folds folds of array_split sizes.
+
+    "same_fold":    each fold grows from a random seed video by its most similar
+                    unassigned videos, so similar videos end up in the same fold.
+    "across_folds": groups of num_folds mutually similar videos are formed the same
+                    way and dealt out one per fold (smallest folds first).
+    Videos without a signature are dealt to the smallest folds at the end.
+    """
+    rng = rng or np.random.default_rng()
+    position = {name: k for k, name in enumerate(names)}
+    known = [v for v in videos if v in position]
+    unknown = [v for v in videos if v not in position]
+    sizes = [len(part) for part in np.array_split(np.arange(len(videos)), num_folds)]
+    folds = [[] for _ in range(num_folds)]
+
+    unassigned = list(known)
+    def take_group(size):
+        seed = unassigned[rng.integers(len(unassigned))]
+        sims = similarity[position[seed], [position[v] for v in unassigned]]
+        group = [unassigned[k] for k in np.argsort(-sims, kind="stable")[:size]]
+        for v in group:
+            unassigned.remove(v)
+        return group
+
+    if mode == "same_fold":
+        for i in range(num_folds):
+            folds[i].extend(take_group(min(sizes[i], len(unassigned))) if unassigned else [])
+    elif mode == "across_folds":
+        while unassigned:
+            group = take_group(min(num_folds, len(unassigned)))
+            open_folds = sorted((k for k in range(num_folds) if len(folds[k]) < sizes[k]),
+                                key=lambda k: (len(folds[k]), rng.random()))
+            for v, k in zip(group, open_folds):
+                folds[k].append(v)
+    else:
+        raise ValueError(f"Unknown fold mode {mode!r}")
+
+    for v in unknown + unassigned:
+        k = min(range(num_folds), key=lambda k: len(folds[k]) - sizes[k])
+        folds[k].append(v)
+    return folds
+
+if __name__ == "__main__":
+    # --- Compute signatures for every video of one or more frame trees ---
+    # Videos are keyed by their path relative to the tree (GANSEG_xx/<video>), the same
+    # key TrainIDs_generator_* uses; the first tree providing a video wins.
+    frame_bases = ["/home/itec/sahar/Domain_Adaptation/Lap_Segmentation_1/insseg",
+                   "/home/itec/sahar/Domain_Adaptation/Lap_Segmentation/ganseg"]  # Adjust the paths as needed.
+    signature_file = "Lap_video_signatures.npz"
+    similarity_csv = "Lap_video_similarity.csv"
+    cache_dir = "Lap_video_signature_cache"
+    valid_ext = (".jpg", ".jpeg", ".png", ".bmp")
+    num_workers = 8
+
+    videos = {}
+    for frame_base in frame_bases:
+        for folder in sorted(os.listdir(frame_base)):
+            folder_path = os.path.join(frame_base, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for video in sorted(os.listdir(folder_path)):
+                video_dir = os.path.join(folder_path, video)
+                if os.path.isdir(video_dir):
+                    videos.setdefault(os.path.join(folder, video), video_dir)
+
+    names, signatures = [], []
+    for name, video_dir in videos.items():
+        paths = [os.path.join(video_dir, f) for f in sorted(os.listdir(video_dir))
+                 if f.lower().endswith(valid_ext)]
+        cache_file = os.path.join(cache_dir, name.replace(os.sep, "__") + ".npz")
+        signature = video_signature(paths, cache_file, num_workers)
+        if signature["frames"]:
+            names.append(name)
+            signatures.append(signature)
+            print(f"{name}: {signature['frames']} frames")
+
+    save_signatures(signature_file, names, signatures)
+    similarity = similarity_matrix(signatures)
+    nearest = nearest_videos(similarity, k=min(3, len(names) - 1))
+    with open(similarity_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["video"] + names + ["nearest"])
+        for k, name in enumerate(names):
+            writer.writerow([name] + [f"{s:.4f}" for s in similarity[k]] +
+                            [";".join(names[j] for j in nearest[k])])
+    print(f"Saved signatures of {len(names)} videos to {signature_file} and similarities to {similarity_csv}")